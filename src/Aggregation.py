@@ -0,0 +1,130 @@
+import numpy as np
+
+
+class P2Median:
+    """Estimate of the median of a stream in constant memory with the P-square algorithm of Jain and Chlamtac"""
+
+    def __init__(self):
+        self.heights = []
+        self.positions = np.arange(1.0, 6.0)
+        self.desired = np.array([1.0, 2.0, 3.0, 4.0, 5.0])
+        self.increments = np.array([0.0, 0.25, 0.5, 0.75, 1.0])
+
+    def add(self, value):
+        """Add a value to the stream"""
+        if len(self.heights) < 5:
+            self.heights.append(float(value))
+            self.heights.sort()
+            return
+        heights = self.heights
+        positions = self.positions
+        if value < heights[0]:
+            heights[0] = float(value)
+            cell = 0
+        elif value >= heights[4]:
+            heights[4] = float(value)
+            cell = 3
+        else:
+            cell = int(np.searchsorted(heights, value, side='right')) - 1
+        positions[cell + 1:] += 1
+        self.desired += self.increments
+
+        # Move the three middle markers towards their desired positions
+        for i in range(1, 4):
+            offset = self.desired[i] - positions[i]
+            if (offset >= 1 and positions[i + 1] - positions[i] > 1) or (
+                    offset <= -1 and positions[i - 1] - positions[i] < -1):
+                step = 1.0 if offset > 0 else -1.0
+                height = heights[i] + step / (positions[i + 1] - positions[i - 1]) * (
+                    (positions[i] - positions[i - 1] + step) * (heights[i + 1] - heights[i]) /
+                    (positions[i + 1] - positions[i]) +
+                    (positions[i + 1] - positions[i] - step) * (heights[i] - heights[i - 1]) /
+                    (positions[i] - positions[i - 1]))
+                if not heights[i - 1] < height < heights[i + 1]:
+                    # Fall back to linear interpolation when the parabola overshoots
+                    j = i + int(step)
+                    height = heights[i] + step * (heights[j] - heights[i]) / (positions[j] - positions[i])
+                heights[i] = height
+                positions[i] += step
+
+    def value(self):
+        """Return the current estimate of the median"""
+        if len(self.heights) == 0:
+            return np.nan
+        if len(self.heights) < 5:
+            return float(np.median(self.heights))
+        return self.heights[2]
+
+
+class StreamingStats:
+    """Running count, mean, variance, median and histogram of a stream of values.
+
+    Mean and variance use Welford's update. The median is exact while the values are
+    kept and estimated with P-square otherwise. The histogram has fixed bins over
+    [0, maximum].
+    """
+
+    def __init__(self, maximum, bins=50, keep_values=True):
+        self.count = 0
+        self.mean = 0.0
+        self.sum_of_squares = 0.0
+        self.p2_median = P2Median()
+        self.bin_edges = np.linspace(0, maximum, bins + 1)
+        self.histogram = np.zeros(bins, dtype=np.int64)
+        self.values = [] if keep_values else None
+
+    def add(self, value):
+        """Add a value to the stream"""
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.sum_of_squares += delta * (value - self.mean)
+        self.p2_median.add(value)
+        cell = np.searchsorted(self.bin_edges, value, side='right') - 1
+        self.histogram[min(max(cell, 0), len(self.histogram) - 1)] += 1
+        if self.values is not None:
+            self.values.append(value)
+
+    def variance(self):
+        """Return the population variance of the values, like np.var"""
+        return self.sum_of_squares / self.count if self.count > 0 else np.nan
+
+    def std(self):
+        """Return the population standard deviation of the values, like np.std"""
+        return np.sqrt(self.variance())
+
+    def median(self):
+        """Return the median of the values, exact if they are kept"""
+        if self.values is not None:
+            return np.median(self.values) if self.values else np.nan
+        return self.p2_median.value()
+
+    def average(self):
+        """Return the mean of the values"""
+        return self.mean if self.count > 0 else np.nan
+
+    def histogram_summary(self):
+        """Return the count of every non-empty bin of the histogram, keyed by the lower edge of the bin"""
+        return {float(self.bin_edges[cell]): int(self.histogram[cell]) for cell in np.flatnonzero(self.histogram)}
+
+
+class ProbabilityAggregate:
+    """Streaming summary of the final number of infected and dead of all runs with one infection probability"""
+
+    def __init__(self, prob, population_count, keep_values=True):
+        self.prob = prob
+        self.epidemics = 0
+        self.truncated = 0
+        self.infected = StreamingStats(population_count, keep_values=keep_values)
+        self.dead = StreamingStats(population_count, keep_values=keep_values)
+
+    def add(self, infected, dead, epidemic=False, truncated=False):
+        """Add the final counts of a run and whether it was an epidemic and stopped early"""
+        self.infected.add(infected)
+        self.dead.add(dead)
+        self.epidemics += int(epidemic)
+        self.truncated += int(truncated)
+
+    def epidemic_fraction(self):
+        """Return the fraction of runs that were epidemics"""
+        return self.epidemics / self.infected.count if self.infected.count > 0 else np.nan
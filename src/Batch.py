@@ -0,0 +1,125 @@
+from DataHandler import DataHandler
+from OutputWriter import flush_output
+from Simulation import Simulation
+import numpy as np
+import argparse
+import csv
+import json
+import os
+import time
+
+ACTIONS = ['run', 'sweep', 'threshold']
+
+
+def read_seeds(path):
+    """Read the random seeds from the first column of a csv file, sorted in ascending order like Main.read_random_seeds"""
+    with open(path) as data_file:
+        return sorted(int(row[0]) for row in csv.reader(data_file) if row)
+
+
+def job_seeds(spec):
+    """Return the seeds of a job given as a list, a {'start', 'stop', 'step'} range or a {'file'} to read"""
+    if isinstance(spec, list):
+        return [int(seed) for seed in spec]
+    if 'file' in spec:
+        return read_seeds(spec['file'])
+    return list(range(spec.get('start', 1), spec['stop'], spec.get('step', 1)))
+
+
+def create_data_handler(params):
+    """Create a data handler with the given attributes set"""
+    data_handler = DataHandler()
+    for name, value in params.items():
+        if not hasattr(data_handler, name):
+            raise ValueError("Unknown parameter: %s" % name)
+        if name == 'init_people_coordinates':
+            value = [tuple(coordinates) for coordinates in value]
+        setattr(data_handler, name, value)
+    return data_handler
+
+
+def run_job(job, defaults=None):
+    """Run one job of a job file. Returns the results of the job"""
+    action = job.get('action', 'sweep')
+    if action not in ACTIONS:
+        raise ValueError("Unknown action: %s" % action)
+    params = dict(defaults or {})
+    params.update(job.get('params', {}))
+    data_handler = create_data_handler(params)
+    if 'seeds' in job:
+        data_handler.random_seeds = job_seeds(job['seeds'])
+    if data_handler.seed is None and data_handler.random_seeds:
+        data_handler.seed = data_handler.random_seeds[0]
+    simulation = Simulation(data_handler)
+    try:
+        return run_action(simulation, action, job)
+    finally:
+        simulation.close()
+
+
+def run_action(simulation, action, job):
+    """Run the action of a job with its simulation. Returns the results of the job"""
+    data_handler = simulation.data_handler
+    if action == 'run':
+        for seed in data_handler.random_seeds or [data_handler.seed]:
+            data_handler.seed = seed
+            simulation.run_simluation()
+        return {str(data_handler.infection_probability): simulation.compile_results()}
+    if action == 'sweep':
+        # Batches run without a display, so the sweeps are not plotted
+        simulation.run_full_simulation(plot=False)
+        results = {}
+        for prob in data_handler.infection_probabilities:
+            data_handler.infection_probability = prob
+            results[str(prob)] = simulation.compile_results()
+        return results
+    return simulation.find_threshold(job.get('tolerance', 0.001))
+
+
+def run_batch(batch):
+    """Run the jobs of a batch back to back. Returns a report with the results and run time of every job.
+
+    A batch is a dict with a list of 'jobs' and optional 'defaults' and 'report' path. Every
+    job has an 'action' ('run', 'sweep' or 'threshold'), 'params' with DataHandler attributes
+    that override the defaults, including output targets like 'output', 'result_store_path'
+    and 'trace_path', and 'seeds'. Threshold searches also take a 'tolerance'.
+    """
+    report = []
+    for number, job in enumerate(batch['jobs']):
+        name = job.get('name', 'job ' + str(number + 1))
+        print("Running", name)
+        start = time.perf_counter()
+        results = run_job(job, batch.get('defaults'))
+        # The time of a job includes writing its results
+        flush_output()
+        report.append({'name': name, 'action': job.get('action', 'sweep'),
+                       'seconds': time.perf_counter() - start, 'results': results})
+    return report
+
+
+def to_json(value):
+    """Convert numpy values for json.dump"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return str(value)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the simulation jobs of a JSON job file without prompts.")
+    parser.add_argument('job_file', help="JSON file with a list of 'jobs' and optional 'defaults' and 'report'")
+    parser.add_argument('--report', default=None, help="JSON file for the results of the jobs")
+    arguments = parser.parse_args()
+
+    with open(arguments.job_file) as job_file:
+        batch = json.load(job_file)
+    report = run_batch(batch)
+    path = arguments.report or batch.get('report')
+    if path:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w') as report_file:
+            json.dump(report, report_file, indent=2, default=to_json)
+        print("Report saved to", path)
@@ -0,0 +1,160 @@
+from DataHandler import DataHandler
+from DataHandler import ACC_INFECTED
+from Simulation import Simulation
+from scipy import stats
+import numpy as np
+import argparse
+import datetime
+import json
+import os
+import platform
+import time
+import tracemalloc
+
+
+def create_data_handler(engine, population_size, infection_probability):
+    """Create the data handler of a benchmark case, with one infected person in the center"""
+    data_handler = DataHandler()
+    data_handler.engine = engine
+    # The tiled engine only runs with counter based random numbers
+    data_handler.random_mode = 'counter' if engine == 'tiled' else 'stream'
+    data_handler.population_size = population_size
+    data_handler.infection_probability = infection_probability
+    data_handler.init_people_coordinates = [(population_size // 2, population_size // 2)]
+    data_handler.output = 'none'
+    return data_handler
+
+
+def run_case(engine, population_size, infection_probability, seeds):
+    """Run the seeds of one benchmark case and measure throughput, phase times and peak memory"""
+    data_handler = create_data_handler(engine, population_size, infection_probability)
+    simulation = Simulation(data_handler)
+    days = 0
+    final_sizes = []
+    phase_seconds = {}
+    counters = {}
+    start = time.perf_counter()
+    try:
+        for seed in seeds:
+            data_handler.seed = seed
+            result = simulation.run_simluation()
+            days += len(result['df'])
+            for name, value in simulation.instrumentation.run_seconds.items():
+                phase_seconds[name] = phase_seconds.get(name, 0.0) + value
+            for name, value in simulation.instrumentation.run_counters.items():
+                counters[name] = counters.get(name, 0) + value
+            final_sizes.append(int(result['df'].values[-1, ACC_INFECTED]) if len(result['df']) > 0 else 0)
+        wall_time = time.perf_counter() - start
+    finally:
+        simulation.close()
+
+    # Tracing slows down the run, so the memory is measured on a separate run of the first seed.
+    # tracemalloc sees NumPy arrays but not the shared memory of the tiled engine.
+    tracemalloc.start()
+    data_handler.seed = seeds[0]
+    simulation = Simulation(data_handler)
+    try:
+        simulation.run_simluation()
+    finally:
+        simulation.close()
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    data = {
+        'engine': engine,
+        'population size': population_size,
+        'infection probability': infection_probability,
+        'seed count': len(seeds),
+        'runs': len(seeds),
+        'days': days,
+        'wall time': wall_time,
+        'days per second': days / wall_time,
+        'cells per second': days * population_size * population_size / wall_time,
+        'phase seconds': phase_seconds,
+        'counters': counters,
+        'peak memory': peak_memory,
+        'final sizes': final_sizes
+    }
+    return data
+
+
+def compare_final_sizes(cases, reference, alpha=0.01):
+    """Test with a two sample Kolmogorov-Smirnov test if every engine gives the final sizes of the reference engine"""
+    checks = []
+    for case in cases:
+        if case['engine'] == reference:
+            continue
+        for other in cases:
+            if (other['engine'] == reference and other['population size'] == case['population size'] and
+                    other['infection probability'] == case['infection probability'] and
+                    other['seed count'] == case['seed count']):
+                statistic, p_value = stats.ks_2samp(other['final sizes'], case['final sizes'])
+                checks.append({
+                    'engine': case['engine'],
+                    'reference': reference,
+                    'population size': case['population size'],
+                    'infection probability': case['infection probability'],
+                    'seed count': case['seed count'],
+                    'statistic': float(statistic),
+                    'p value': float(p_value),
+                    'agree': bool(p_value > alpha)
+                })
+    return checks
+
+
+def run_benchmark(engines, population_sizes, infection_probabilities, seed_counts):
+    """Benchmark every engine on every (population size, infection probability, seed count) case"""
+    cases = []
+    for population_size in population_sizes:
+        for infection_probability in infection_probabilities:
+            for seed_count in seed_counts:
+                seeds = list(range(1, seed_count + 1))
+                for engine in engines:
+                    case = run_case(engine, population_size, infection_probability, seeds)
+                    print("%-10s size %6d prob %.3f seeds %4d: %12.0f cells/s %8.1f days/s %10d bytes" % (
+                        engine, population_size, infection_probability, seed_count, case['cells per second'],
+                        case['days per second'], case['peak memory']))
+                    cases.append(case)
+
+    data = {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.platform(),
+        'cases': cases,
+        'final size checks': compare_final_sizes(cases, engines[0])
+    }
+    return data
+
+
+def save_benchmark(data, path):
+    """Save benchmark results as JSON"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as benchmark_file:
+        json.dump(data, benchmark_file, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the speed and memory of the simulation engines.")
+    parser.add_argument('--engines', nargs='+', default=['object', 'vectorized', 'frontier', 'event', 'network'],
+                        help="engines to compare, the first one is the reference of the final size check")
+    parser.add_argument('--sizes', nargs='+', type=int, default=[50, 100, 200])
+    parser.add_argument('--probabilities', nargs='+', type=float, default=[0.05, 0.2])
+    parser.add_argument('--seeds', nargs='+', type=int, default=[10], help="numbers of seeds per case")
+    parser.add_argument('--output', default=None,
+                        help="JSON file of the results, by default ../res/benchmarks/<date and time>.json")
+    arguments = parser.parse_args()
+
+    data = run_benchmark(arguments.engines, arguments.sizes, arguments.probabilities, arguments.seeds)
+    path = arguments.output
+    if path is None:
+        path = "../res/benchmarks/" + data['created'].replace(':', '-') + ".json"
+    save_benchmark(data, path)
+    for check in data['final size checks']:
+        if not check['agree']:
+            print("Final sizes of %s differ from %s at size %d, probability %.3f, %d seeds (p = %.4f)" % (
+                check['engine'], check['reference'], check['population size'],
+                check['infection probability'], check['seed count'], check['p value']))
+    print("Results saved to", path)
@@ -0,0 +1,171 @@
+from Engines import create_engine
+import numpy as np
+import json
+import os
+import struct
+
+# Parameters of the data handler that a resumed run must share with the checkpointed one
+RUN_PARAMETERS = ['population_size', 'infection_probability', 'interval', 'mortality_probability',
+                  'init_people_coordinates', 'engine', 'random_mode', 'classify_only', 'seed', 'current_day',
+                  'topology', 'topology_radius', 'rewire_probability', 'edges_per_node', 'edge_list_path',
+                  'topology_seed']
+
+
+def save_checkpoint(simulation, path):
+    """Save the state of a run at the current day to a compressed .npz file. Returns the size of the file"""
+    data_handler = simulation.data_handler
+    arrays = {}
+    meta = {
+        'parameters': {name: getattr(data_handler, name) for name in RUN_PARAMETERS},
+        'engine': split_arrays(simulation.engine.get_state(), 'engine', arrays)
+    }
+    arrays['series'] = data_handler.series.view()
+    arrays['meta'] = np.frombuffer(json.dumps(meta, default=to_json).encode('utf-8'), dtype=np.uint8)
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # Write next to the old checkpoint first, so a crash never leaves a broken one behind
+    with open(path + '.tmp', 'wb') as checkpoint_file:
+        np.savez_compressed(checkpoint_file, **arrays)
+    os.replace(path + '.tmp', path)
+    return os.path.getsize(path)
+
+
+def load_checkpoint(simulation, path):
+    """Restore a run saved by save_checkpoint into the simulation and its data handler"""
+    data_handler = simulation.data_handler
+    with np.load(path) as checkpoint:
+        arrays = {name: checkpoint[name] for name in checkpoint.files}
+    meta = json.loads(arrays.pop('meta').tobytes().decode('utf-8'))
+    for name, value in meta['parameters'].items():
+        if name == 'init_people_coordinates':
+            value = [tuple(coordinates) for coordinates in value]
+        setattr(data_handler, name, value)
+
+    data_handler.series.load(arrays.pop('series'))
+    simulation.engine.close()
+    simulation.engine = create_engine(data_handler)
+    simulation.engine.set_state(join_arrays(meta['engine'], arrays))
+
+
+def split_arrays(state, prefix, arrays):
+    """Move the arrays of a nested state dict into arrays under dotted names, leaving their names in place"""
+    if isinstance(state, dict):
+        return {key: split_arrays(value, prefix + '.' + key, arrays) for key, value in state.items()}
+    if isinstance(state, np.ndarray):
+        arrays[prefix] = state
+        return {'array': prefix}
+    return state
+
+
+def join_arrays(state, arrays):
+    """Put the arrays moved out by split_arrays back into the nested state dict"""
+    if isinstance(state, dict):
+        if set(state) == {'array'}:
+            return arrays[state['array']]
+        return {key: join_arrays(value, arrays) for key, value in state.items()}
+    return state
+
+
+def to_json(value):
+    """Convert numpy scalars for json.dumps"""
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    if isinstance(value, np.bool_):
+        return bool(value)
+    raise TypeError("Cannot save %r in a checkpoint" % (value,))
+
+
+# A state log starts with a tag, the grid size and the grid before day 0, followed by
+# one record per changed cell and day
+STATE_LOG_TAG = b'STATELOG'
+STATE_LOG_HEADER = struct.Struct('<8sQ')
+CHANGE = np.dtype([('day', '<i4'), ('cell', '<i8'), ('state', 'i1')])
+
+
+class StateLogWriter:
+    """Append-only log of the state grid of a run, stored as the cells that changed each day"""
+
+    def __init__(self, path, state_grid, current_day=0):
+        self.path = path
+        self.previous = np.array(state_grid, dtype=np.int8)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if current_day > 0 and os.path.exists(path):
+            # Resuming: drop the days from the resumed day onwards and continue the log
+            log = StateLog(path)
+            end = log.header_size + log.changes_before(current_day) * CHANGE.itemsize
+            log.close()
+            self.log_file = open(path, 'r+b')
+            self.log_file.truncate(end)
+            self.log_file.seek(end)
+        else:
+            self.log_file = open(path, 'wb')
+            self.log_file.write(STATE_LOG_HEADER.pack(STATE_LOG_TAG, len(self.previous)))
+            self.log_file.write(self.previous.tobytes())
+
+    def record(self, current_day, state_grid):
+        """Append the cells that changed since the previous record. Returns the number of bytes written"""
+        changed = np.flatnonzero(state_grid != self.previous)
+        changes = np.empty(len(changed), dtype=CHANGE)
+        changes['day'] = current_day
+        changes['cell'] = changed
+        changes['state'] = state_grid.reshape(-1)[changed]
+        self.log_file.write(changes.tobytes())
+        self.previous.reshape(-1)[changed] = changes['state']
+        return changes.nbytes
+
+    def close(self):
+        """Close the log file"""
+        self.log_file.close()
+
+
+class StateLog:
+    """Memory mapped reader of a state log, for replaying and re-rendering a run without simulating it"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as log_file:
+            tag, size = STATE_LOG_HEADER.unpack(log_file.read(STATE_LOG_HEADER.size))
+        if tag != STATE_LOG_TAG:
+            raise ValueError("Not a state log: %s" % path)
+        self.population_size = size
+        self.header_size = STATE_LOG_HEADER.size + size * size
+        self.initial = np.memmap(path, dtype=np.int8, mode='r', offset=STATE_LOG_HEADER.size, shape=(size, size))
+        count = (os.path.getsize(path) - self.header_size) // CHANGE.itemsize
+        if count > 0:
+            self.changes = np.memmap(path, dtype=CHANGE, mode='r', offset=self.header_size, shape=(count,))
+        else:
+            self.changes = np.zeros(0, dtype=CHANGE)
+
+    def changes_before(self, current_day):
+        """Return the number of changes recorded before a day"""
+        return int(np.searchsorted(self.changes['day'], current_day, side='left'))
+
+    def state_at(self, current_day):
+        """Return the state grid at the end of a day"""
+        grid = np.array(self.initial)
+        changes = self.changes[:self.changes_before(current_day + 1)]
+        grid.reshape(-1)[changes['cell']] = changes['state']
+        return grid
+
+    def replay(self):
+        """Yield the day and state grid at the end of every recorded day"""
+        grid = np.array(self.initial)
+        days = self.changes['day']
+        if len(days) == 0:
+            return
+        for current_day in range(0, int(days[-1]) + 1):
+            start = self.changes_before(current_day)
+            stop = self.changes_before(current_day + 1)
+            changes = self.changes[start:stop]
+            grid.reshape(-1)[changes['cell']] = changes['state']
+            yield current_day, grid
+
+    def close(self):
+        """Release the memory maps"""
+        self.initial = None
+        self.changes = None
@@ -1,5 +1,113 @@
+from Aggregation import ProbabilityAggregate
+from OutputWriter import output_writer
+import numpy as np
 import pandas as pd
-import os
+
+# Columns of the daily series of a run, in the order of the data summary
+METRICS = ['susceptible_per_day', 'infected_per_day', 'dead_per_day', 'recovered_per_day',
+           'recovered_accumulated', 'sick_per_day', 'infected_accumulated', 'dead_accumulated']
+SUSCEPTIBLE, INFECTED, DEAD, RECOVERED, ACC_RECOVERED, SICK, ACC_INFECTED, ACC_DEAD = range(len(METRICS))
+
+
+def summary_row(counts, previous):
+    """Build the metric row of a day from its census counts and the row of the previous day.
+
+    The counts can also be arrays with one entry per run, giving one row per run.
+    """
+    susceptible_count, infected_count, sick_count, recovered_count, dead_count = counts
+    row = np.empty(np.shape(previous), dtype=np.int64)
+    row[..., SUSCEPTIBLE] = susceptible_count
+    row[..., INFECTED] = infected_count
+    row[..., DEAD] = dead_count
+    row[..., RECOVERED] = recovered_count
+    row[..., SICK] = sick_count
+    row[..., ACC_RECOVERED] = previous[..., ACC_RECOVERED] + recovered_count
+    row[..., ACC_INFECTED] = previous[..., ACC_INFECTED] + infected_count
+    row[..., ACC_DEAD] = previous[..., ACC_DEAD] + dead_count
+    return row
+
+
+class SeriesBuffer:
+    """Growable (days x metrics) buffer holding the daily series of a run.
+
+    The buffer keeps its memory between runs and doubles it when full. Views and
+    frames share the memory of the buffer and are only valid until the next clear.
+    """
+
+    def __init__(self, capacity=256):
+        self.data = np.zeros((capacity, len(METRICS)), dtype=np.int64)
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def clear(self):
+        """Empty the buffer without giving back its memory"""
+        self.length = 0
+
+    def record(self, counts):
+        """Append the metric row of a day given its census counts"""
+        if self.length == len(self.data):
+            self.data = np.concatenate((self.data, np.zeros_like(self.data)))
+        previous = self.data[self.length - 1] if self.length > 0 else np.zeros(len(METRICS), dtype=np.int64)
+        self.data[self.length] = summary_row(counts, previous)
+        self.length += 1
+
+    def load(self, values):
+        """Replace the recorded days with a (days x metrics) array"""
+        if len(values) > len(self.data):
+            self.data = np.zeros((len(values), len(METRICS)), dtype=np.int64)
+        self.data[:len(values)] = values
+        self.length = len(values)
+
+    def view(self):
+        """Return the recorded days as a (days x metrics) array"""
+        return self.data[:self.length]
+
+    def column(self, metric):
+        """Return the recorded days of one metric"""
+        return self.data[:self.length, METRICS.index(metric)]
+
+    def frame(self, copy=False):
+        """Return the recorded days as a DataFrame with one column per metric"""
+        return pd.DataFrame(self.view(), columns=METRICS, copy=copy)
+
+    def records(self):
+        """Return the recorded days as a structured array with one field per metric"""
+        return self.view().view(np.dtype([(metric, np.int64) for metric in METRICS])).reshape(-1)
+
+
+class SeriesBlock:
+    """Growable (runs x days x metrics) block holding the daily series of a batch of runs"""
+
+    def __init__(self, runs, capacity=256):
+        self.data = np.zeros((runs, capacity, len(METRICS)), dtype=np.int64)
+        self.lengths = np.zeros(runs, dtype=np.int64)
+
+    def clear(self, runs):
+        """Empty the block for a batch of runs, keeping its memory if it is large enough"""
+        if runs > len(self.data):
+            self.data = np.zeros((runs, self.data.shape[1], len(METRICS)), dtype=np.int64)
+        self.lengths = np.zeros(runs, dtype=np.int64)
+
+    def record(self, runs, current_day, counts):
+        """Save the metric rows of a day for the given runs from arrays of census counts"""
+        if current_day == self.data.shape[1]:
+            self.data = np.concatenate((self.data, np.zeros_like(self.data)), axis=1)
+        if current_day > 0:
+            previous = self.data[runs, current_day - 1]
+        else:
+            previous = np.zeros((len(runs), len(METRICS)), dtype=np.int64)
+        self.data[runs, current_day] = summary_row(counts, previous)
+        self.lengths[runs] = current_day + 1
+
+    def view(self, run):
+        """Return the recorded days of a run as a (days x metrics) array"""
+        return self.data[run, :self.lengths[run]]
+
+    def frame(self, run, copy=False):
+        """Return the recorded days of a run as a DataFrame with one column per metric"""
+        return pd.DataFrame(self.view(run), columns=METRICS, copy=copy)
 
 
 class DataHandler:
@@ -13,17 +121,47 @@ class DataHandler:
         self.mortality_probability = 0.0
         self.random_seeds = None
         self.init_people_coordinates = []
+        "Visualization of each day. 0 is off, 1 saves a scatter plot per day, 2 saves fast raster frames."
         self.visualize = 0
+        "Raster frames are 'png' files per day or one 'stack' file per run, scaled to frame_scale pixels per person (0 picks a scale)."
+        self.frame_format = 'png'
+        self.frame_scale = 0
+        "Simulation engine. 'object' loops over Person objects, 'vectorized' updates the whole grid with NumPy arrays, 'frontier' only visits infected cells and their neighbours, 'event' also schedules recoveries and deaths at infection, 'tiled' splits the grid over worker processes, 'network' infects over any contact network with a sparse matrix product."
+        self.engine = 'object'
+        "Number of row strips the 'tiled' engine splits the grid into, each updated by its own worker process"
+        self.tiles = 4
+        "Contact network of the 'object' and 'network' engines. 'lattice' connects the cells within topology_radius on the torus, 'small_world' rewires its edges with rewire_probability, 'scale_free' grows a network with edges_per_node by preferential attachment, 'edge_list' reads pairs of cell numbers x * population_size + y from edge_list_path."
+        self.topology = 'lattice'
+        self.topology_radius = 1
+        self.rewire_probability = 0.1
+        self.edges_per_node = 4
+        self.edge_list_path = None
+        "Seed of the random networks, fixed so that every run uses the same network"
+        self.topology_seed = 0
+        "Number of seeds that run_full_simulation advances together with the ensemble engine. 0 runs the seeds one at a time. The replicates reproduce the 'vectorized' engine whatever engine is selected, and the ensemble engine can not visualize, log states, checkpoint or trace, so those settings must be off."
+        self.ensemble_size = 0
+        "Number of worker processes that run_full_simulation spreads the runs over. 1 runs them serially."
+        self.processes = 1
+        "Random numbers of the array engines. 'stream' draws them in order from a numpy Generator per run, 'counter' derives them from (seed, day, cell) so they do not depend on the order cells are visited."
+        self.random_mode = 'stream'
+        "Where data_summary saves each run. 'csv' writes ../res/<probability>/<seed>.csv, 'store' appends to the result store file, 'none' saves nothing."
+        self.output = 'csv'
+        "Stop a run as soon as it is known to be an epidemic, i.e. more than epidemic_size people got infected. The series of such a run is truncated."
+        self.classify_only = False
+        self.result_store_path = '../res/results.store'
+        "Directory of the result cache. Runs found in it are read instead of simulated again. None disables the cache."
+        self.cache_path = None
+        "Size in bytes above which the least recently used runs are removed from the cache"
+        self.cache_size = 2 ** 30
+        "Save a checkpoint of the running simulation every checkpoint_interval days to ../res/<probability>/checkpoints/<seed>.npz. 0 saves none."
+        self.checkpoint_interval = 0
+        "Log the cells that change state every day to ../res/<probability>/<seed>.statelog, for replaying and re-rendering runs."
+        self.state_log = False
 
         "Outdata for each run"
-        self.susceptible_per_day = []
-        self.infected_per_day = []
-        self.dead_per_day = []
-        self.recovered_per_day = []
-        self.acc_recovered_per_day = []
-        self.sick_per_day = []
-        self.acc_infected_per_day = []
-        self.acc_dead_per_day = []
+        self.series = SeriesBuffer()
+        "Outdata for each batch of runs of the ensemble engine"
+        self.ensemble_series = None
 
         "Infection probability. Used for determining the threshold for an epidemic."
         self.infection_probabilities = [0.04, 0.042, 0.044, 0.046, 0.048, 0.05]
@@ -32,39 +170,85 @@ class DataHandler:
         "Active simulation data"
         self.seed = None
         self.current_day = 0
+        "Keep the full series of every run in data_frames. Statistics and plots only need the aggregates."
+        self.retain_frames = False
         self.data_frames = []
+        "Streaming summary of the finished runs per infection probability"
+        self.aggregates = {}
+        "Keep the final counts of every run in the aggregates for exact medians and bootstrap intervals. False keeps their memory constant, estimating the medians with P-square and leaving the intervals out."
+        self.keep_run_values = True
+        "Number of bootstrap resamples and confidence level of the intervals of the results"
+        self.bootstrap_resamples = 2000
+        self.confidence_level = 0.95
+        "Append the timings and counters of the phases of every day and run as JSON lines to trace_path. None traces nothing."
+        self.trace_path = None
 
-    def data_summary(self, random_seed):
-        """Summarize the data for a simulation"""
-        data = {
-            'susceptible_per_day': self.susceptible_per_day,
-            'infected_per_day': self.infected_per_day,
-            'dead_per_day': self.dead_per_day,
-            'recovered_per_day': self.recovered_per_day,
-            'recovered_accumulated': self.acc_recovered_per_day,
-            'sick_per_day': self.sick_per_day,
-            'infected_accumulated': self.acc_infected_per_day,
-            'dead_accumulated': self.acc_dead_per_day
-        }
+    @property
+    def susceptible_per_day(self):
+        return self.series.column('susceptible_per_day')
 
-        df = pd.DataFrame(data)
-        path = "../res/" + str(self.infection_probability)
+    @property
+    def infected_per_day(self):
+        return self.series.column('infected_per_day')
 
-        if os.path.isdir(path):
-            df.to_csv(path +
-                      "/" + str(random_seed) + ".csv")
-        else:
-            try:
-                os.mkdir(path)
-                df.to_csv(path +
-                          "/" + str(random_seed) + ".csv")
-            except OSError:
-                print("Creation of the directory %s failed" % path)
-            else:
-                print("Successfully created the directory %s " % path)
+    @property
+    def dead_per_day(self):
+        return self.series.column('dead_per_day')
 
+    @property
+    def recovered_per_day(self):
+        return self.series.column('recovered_per_day')
+
+    @property
+    def acc_recovered_per_day(self):
+        return self.series.column('recovered_accumulated')
+
+    @property
+    def sick_per_day(self):
+        return self.series.column('sick_per_day')
+
+    @property
+    def acc_infected_per_day(self):
+        return self.series.column('infected_accumulated')
+
+    @property
+    def acc_dead_per_day(self):
+        return self.series.column('dead_accumulated')
+
+    def data_summary(self, random_seed, values=None):
+        """Summarize the data for a simulation. The values default to the series of the current run.
+
+        The results are written by the output writer in the background.
+        """
+        if values is None:
+            values = self.series.view()
+        # The frame is kept after the buffer is reused, so it gets its own copy
+        df = pd.DataFrame(values, columns=METRICS, copy=True)
+        if self.output == 'store':
+            self.store_results(random_seed, df.values)
+        elif self.output == 'csv':
+            path = "../res/" + str(self.infection_probability) + "/" + str(random_seed) + ".csv"
+            output_writer().write_csv(path, df)
         return df
 
+    def epidemic_size(self):
+        """Number of infected people above which a run counts as an epidemic outbreak"""
+        return np.square(self.population_size) / 2
+
+    def aggregate(self, prob):
+        """Return the streaming summary of the runs with an infection probability"""
+        if prob not in self.aggregates:
+            self.aggregates[prob] = ProbabilityAggregate(prob, np.square(self.population_size),
+                                                         keep_values=self.keep_run_values)
+        return self.aggregates[prob]
+
+    def store_results(self, random_seed, values):
+        """Queue the series of a run for the result store together with its input parameters"""
+        params = self.input_data_summary()
+        del params['random seeds']
+        output_writer().append_store(self.result_store_path, self.infection_probability, random_seed,
+                                     np.array(values, dtype=np.int64), METRICS, params)
+
     def input_data_summary(self):
         """Summarize input data. Used for debugging"""
         data = {
@@ -74,18 +258,28 @@ class DataHandler:
             'mortality probability': self.mortality_probability,
             'random seeds': self.random_seeds,
             'initial coordinates': self.init_people_coordinates,
-            'visualization': self.visualize
+            'visualization': self.visualize,
+            'engine': self.engine,
+            'topology': self.topology,
+            'topology radius': self.topology_radius,
+            'rewire probability': self.rewire_probability,
+            'edges per node': self.edges_per_node,
+            'edge list path': self.edge_list_path,
+            'topology seed': self.topology_seed,
+            'ensemble size': self.ensemble_size,
+            'tiles': self.tiles,
+            'processes': self.processes,
+            'random mode': self.random_mode,
+            'output': self.output,
+            'classify only': self.classify_only,
+            'checkpoint interval': self.checkpoint_interval,
+            'state log': self.state_log,
+            'trace path': self.trace_path,
+            'cache path': self.cache_path
         }
         return data
 
     def reset(self):
         """Reset datahandler fields"""
         self.current_day = 0
-        self.susceptible_per_day = []
-        self.infected_per_day = []
-        self.dead_per_day = []
-        self.recovered_per_day = []
-        self.acc_recovered_per_day = []
-        self.sick_per_day = []
-        self.acc_infected_per_day = []
-        self.acc_dead_per_day = []
+        self.series.clear()
@@ -14,13 +14,17 @@ class Person(object):
 
     def __init__(self, id, x, y):
         self.id = id
+        self.neighbours = None
+        self.coordinates = {'x': x, 'y': y}
+        self.reset()
+
+    def reset(self):
+        """Make the person susceptible again, keeping the id, coordinates and neighbours"""
         self.state = State.susceptible
         self.sick_days = 0
-        self.neighbours = None
         self.day_of_infection = None
         self.day_of_death = None
         self.day_of_immunity = None
-        self.coordinates = {'x': x, 'y': y}
 
     def __repr__(self):
         representation = {
@@ -35,35 +39,36 @@ class Person(object):
         return repr(representation)
 
     def infect(self, infection_probability, current_day, interval):
-        """Infect the person based on infection probability"""
+        """Infect the person based on infection probability. Returns True if the person got infected"""
         if self.state == State.susceptible:
             min_days = interval['minDays']
             max_days = interval['maxDays'] + 1
-            weights = [infection_probability, 1.0 - infection_probability]
-            outcomes = [1, 0]
-            infected = np.random.choice(outcomes, p=weights)
-            if infected:
+            # A single uniform draw compared to the probability gives the same outcome
+            # as np.random.choice([1, 0], p=[probability, 1 - probability]), only faster.
+            if np.random.random_sample() < infection_probability:
                 self.day_of_infection = current_day
                 self.state = State.infected
                 self.sick_days = np.random.randint(min_days, max_days)
+                return True
+        return False
 
     def update(self, current_day, mortality_probability):
-        """Update the status of the person after each passing day"""
+        """Update the status of the person after each passing day. Returns the new state if it changed"""
         if self.state == State.infected:
 
             if self.sick_days > 0 and current_day - self.day_of_infection >= self.sick_days:
                 # Person has recovered and is henceforth immune
                 self.state = State.immune
                 self.day_of_immunity = current_day
+                return self.state
 
             else:
                 # Person might die due to the mortality probability
-                weights = [mortality_probability, 1.0 - mortality_probability]
-                outcomes = [1, 0]
-                died = np.random.choice(outcomes, p=weights)
-                if died:
+                if np.random.random_sample() < mortality_probability:
                     self.state = State.dead
                     self.day_of_death = current_day
+                    return self.state
+        return None
 
     def get_neighbours(self):
         """Get the list of neighbours to the person"""
@@ -81,15 +86,30 @@ class Population:
         id = 1
         for x in range(0, self.population_size):
             for y in range(0, self.population_size):
-                person = Person(id, x, y)
-                for initial in data_handler.init_people_coordinates:
-                    if initial == (x, y):
-                        person.infect(1.0, 0, data_handler.interval)
-                self.population[x, y] = person
+                self.population[x, y] = Person(id, x, y)
                 id += 1
+        self.infect_initial(data_handler)
+
+    def reset(self, data_handler):
+        """Make everybody susceptible again and infect the initial people. The neighbours are kept"""
+        for person in self.population.flat:
+            if person.state != State.susceptible:
+                person.reset()
+        self.infect_initial(data_handler)
 
-    def generate_neighbours(self):
-        """Generate 8 closest neighbours in 8 directions"""
+    def infect_initial(self, data_handler):
+        """Infect the initial people in the order of their cells, which is the order of their random draws"""
+        for cell in initial_cells(data_handler):
+            x, y = divmod(int(cell), self.population_size)
+            self.population[x, y].infect(1.0, 0, data_handler.interval)
+
+    def generate_neighbours(self, topology=None):
+        """Generate 8 closest neighbours in 8 directions, or the neighbours of each person in a contact network"""
+        if topology is not None:
+            people = self.population.reshape(-1)
+            for node, person in enumerate(people):
+                person.neighbours = people[topology.neighbours(node)]
+            return
         max_range = self.population_size
         for i in range(0, max_range):
             for j in range(0, max_range):
@@ -116,3 +136,246 @@ class Population:
             if x.state == State.infected:
                 return True
         return False
+
+
+class PersonView(object):
+    """Lightweight read-only view of one cell in a CompactPopulation, presented like a Person"""
+    __slots__ = ('population_holder', 'x', 'y')
+
+    def __init__(self, population_holder, x, y):
+        self.population_holder = population_holder
+        self.x = x
+        self.y = y
+
+    def __repr__(self):
+        representation = {
+            'id': self.id,
+            'state': self.state.name,
+            'number of sick days': self.sick_days,
+            'day of infection': self.day_of_infection,
+            'day of death': self.day_of_death,
+            'day of immunity': self.day_of_immunity,
+            'coordinates': self.coordinates
+        }
+        return repr(representation)
+
+    def _day(self, days):
+        """Convert a stored day to the Person convention, where None means it has not happened"""
+        day = int(days[self.x, self.y])
+        return None if day < 0 else day
+
+    @property
+    def id(self):
+        return self.x * self.population_holder.population_size + self.y + 1
+
+    @property
+    def state(self):
+        return State(int(self.population_holder.state[self.x, self.y]))
+
+    @property
+    def sick_days(self):
+        return int(self.population_holder.sick_days[self.x, self.y])
+
+    @property
+    def day_of_infection(self):
+        return self._day(self.population_holder.day_of_infection)
+
+    @property
+    def day_of_death(self):
+        return self._day(self.population_holder.day_of_death)
+
+    @property
+    def day_of_immunity(self):
+        return self._day(self.population_holder.day_of_immunity)
+
+    @property
+    def coordinates(self):
+        return {'x': self.x, 'y': self.y}
+
+    def get_neighbours(self):
+        """Get the 8 closest neighbours in the order used by Population.generate_neighbours"""
+        max_range = self.population_holder.population_size
+        above = (self.y + 1) % max_range
+        below = (self.y - 1) % max_range
+        left = (self.x - 1) % max_range
+        right = (self.x + 1) % max_range
+        coordinates = [(right, self.y), (left, self.y), (self.x, above), (self.x, below),
+                       (right, above), (right, below), (left, below), (left, above)]
+        return [PersonView(self.population_holder, x, y) for x, y in coordinates]
+
+
+def initial_cells(data_handler):
+    """Return the sorted flat indices of the cells of the initial coordinates, ignoring those off the grid"""
+    size = data_handler.population_size
+    coordinates = np.asarray(data_handler.init_people_coordinates, dtype=np.int64).reshape(-1, 2)
+    on_grid = ((coordinates >= 0) & (coordinates < size)).all(axis=1)
+    return np.unique(coordinates[on_grid, 0] * size + coordinates[on_grid, 1])
+
+
+# Arrays of a CompactPopulation, in the order of the Person fields, and their types
+POPULATION_FIELDS = ('state', 'sick_days', 'day_of_infection', 'day_of_death', 'day_of_immunity')
+POPULATION_DTYPES = (np.int8, np.int8, np.int16, np.int16, np.int16)
+# Largest number of sick days and largest day the arrays of a CompactPopulation hold
+MAX_SICK_DAYS = np.iinfo(np.int8).max
+MAX_DAY = np.iinfo(np.int16).max
+
+
+def check_compact_interval(interval):
+    """Raise a ValueError if the sick days of an interval do not fit the arrays of a CompactPopulation"""
+    if not 0 <= interval['minDays'] <= interval['maxDays'] <= MAX_SICK_DAYS:
+        raise ValueError("The array engines need 0 <= minDays <= maxDays <= %d, got %s" % (MAX_SICK_DAYS, interval))
+
+
+def check_compact_day(current_day):
+    """Raise a ValueError if a day does not fit the arrays of a CompactPopulation"""
+    if current_day > MAX_DAY:
+        raise ValueError("The array engines store days up to %d, the run reached day %d" % (MAX_DAY, current_day))
+
+
+class CompactPopulation:
+    """Population stored as one typed array per Person field.
+
+    Coordinates are the array indices and neighbours are implied by the torus,
+    so a cell costs 8 bytes instead of a Person object with its own neighbour array.
+    Days that have not happened are stored as -1.
+    """
+
+    def __init__(self, data_handler):
+        check_compact_interval(data_handler.interval)
+        self.population_size = data_handler.population_size
+        shape = (self.population_size, self.population_size)
+        self.state = np.full(shape, State.susceptible.value, dtype=np.int8)
+        self.sick_days = np.zeros(shape, dtype=np.int8)
+        self.day_of_infection = np.full(shape, -1, dtype=np.int16)
+        self.day_of_death = np.full(shape, -1, dtype=np.int16)
+        self.day_of_immunity = np.full(shape, -1, dtype=np.int16)
+
+    @classmethod
+    def from_buffer(cls, population_size, buffer):
+        """Create a population whose arrays live in a buffer, such as shared memory, of buffer_size bytes.
+
+        The arrays are not initialized, so a new buffer needs clear().
+        """
+        population = cls.__new__(cls)
+        population.population_size = population_size
+        shape = (population_size, population_size)
+        offset = 0
+        for field, dtype in zip(POPULATION_FIELDS, POPULATION_DTYPES):
+            array = np.ndarray(shape, dtype=dtype, buffer=buffer, offset=offset)
+            setattr(population, field, array)
+            offset += array.nbytes
+        return population
+
+    @staticmethod
+    def buffer_size(population_size):
+        """Return the number of bytes of the arrays of a population"""
+        return population_size * population_size * sum(np.dtype(dtype).itemsize for dtype in POPULATION_DTYPES)
+
+    def clear(self):
+        """Make every cell susceptible"""
+        self.state[...] = State.susceptible.value
+        self.sick_days[...] = 0
+        self.day_of_infection[...] = -1
+        self.day_of_death[...] = -1
+        self.day_of_immunity[...] = -1
+
+    def __getitem__(self, coordinates):
+        x, y = coordinates
+        return PersonView(self, x, y)
+
+    def __iter__(self):
+        for x in range(0, self.population_size):
+            for y in range(0, self.population_size):
+                yield PersonView(self, x, y)
+
+    @property
+    def nbytes(self):
+        """Memory used by the state arrays in bytes"""
+        return (self.state.nbytes + self.sick_days.nbytes + self.day_of_infection.nbytes +
+                self.day_of_death.nbytes + self.day_of_immunity.nbytes)
+
+    def infect(self, cells, current_day, sick_days):
+        """Infect the cells selected by a boolean mask with their drawn number of sick days"""
+        self.state[cells] = State.infected.value
+        self.day_of_infection[cells] = current_day
+        self.sick_days[cells] = sick_days
+
+    def infected_present(self):
+        """Return True if any infected people are present, False otherwise"""
+        return bool((self.state == State.infected.value).any())
+
+    def get_state(self):
+        """Return copies of the state arrays so that they can be restored later"""
+        return {field: getattr(self, field).copy() for field in POPULATION_FIELDS}
+
+    def set_state(self, state):
+        """Restore arrays returned by get_state"""
+        for field in POPULATION_FIELDS:
+            getattr(self, field)[...] = state[field]
+
+
+class Tally:
+    """Population counts kept up to date at every state transition.
+
+    The counts can be numbers or arrays with one entry per replicate. Counts of the
+    day start over at the first transition or snapshot of a new day.
+    """
+
+    def __init__(self, population_count):
+        self.day = 0
+        self.susceptible = population_count
+        self.infected = population_count * 0
+        self.infected_today = population_count * 0
+        self.recovered_today = population_count * 0
+        self.dead_today = population_count * 0
+
+    def new_day(self, current_day):
+        """Start over the counts of the day if the day has changed"""
+        if current_day != self.day:
+            self.day = current_day
+            self.infected_today = self.infected_today * 0
+            self.recovered_today = self.recovered_today * 0
+            self.dead_today = self.dead_today * 0
+
+    def infection(self, current_day, count=1):
+        """Count susceptible people that got infected"""
+        self.new_day(current_day)
+        self.susceptible -= count
+        self.infected += count
+        self.infected_today += count
+
+    def recovery(self, current_day, count=1, infected_today=0):
+        """Count infected people that became immune, of which infected_today got infected the same day"""
+        self.new_day(current_day)
+        self.infected -= count
+        self.infected_today -= infected_today
+        self.recovered_today += count
+
+    def death(self, current_day, count=1, infected_today=0):
+        """Count infected people that died, of which infected_today got infected the same day"""
+        self.new_day(current_day)
+        self.infected -= count
+        self.infected_today -= infected_today
+        self.dead_today += count
+
+    def select(self, replicates):
+        """Keep the counts of the selected replicates only"""
+        self.susceptible = self.susceptible[replicates]
+        self.infected = self.infected[replicates]
+        self.infected_today = self.infected_today[replicates]
+        self.recovered_today = self.recovered_today[replicates]
+        self.dead_today = self.dead_today[replicates]
+
+    def get_state(self):
+        """Return the counts so that they can be restored later"""
+        return dict(vars(self))
+
+    def set_state(self, state):
+        """Restore counts returned by get_state"""
+        vars(self).update(state)
+
+    def snapshot(self, current_day):
+        """Return the susceptible, newly infected, sick, recovered and dead counts of the day"""
+        self.new_day(current_day)
+        return (self.susceptible, self.infected_today, self.infected - self.infected_today,
+                self.recovered_today, self.dead_today)
@@ -0,0 +1,952 @@
+from DataHandler import ACC_INFECTED
+from DataModels import CompactPopulation
+from DataModels import POPULATION_FIELDS
+from DataModels import Population
+from DataModels import State
+from DataModels import Tally
+from DataModels import check_compact_day
+from DataModels import check_compact_interval
+from DataModels import initial_cells
+from RandomStreams import INFECTION
+from RandomStreams import MORTALITY
+from RandomStreams import SICK_DAYS
+from RandomStreams import CounterStream
+from RandomStreams import create_random_stream
+from Topology import is_moore_lattice
+from Topology import shared_topology
+from Topology import topology_key
+import atexit
+import multiprocessing
+import numpy as np
+
+
+class ObjectEngine:
+    """Engine running the simulation on a grid of Person objects"""
+
+    def __init__(self, data_handler):
+        self.data_handler = data_handler
+        self.population_holder = None
+        # Network the people of the population are linked by
+        self.topology_key = None
+        self.tally = None
+        # Infections attempted and succeeded and cells visited by the infection step of the current day
+        self.counters = {}
+
+    def reset(self):
+        """Reset the population for the current data handler values.
+
+        The people and their neighbours are created once per network and reset in place for the next runs.
+        """
+        key = topology_key(self.data_handler)
+        if self.population_holder is None or self.topology_key != key:
+            self.population_holder = Population(self.data_handler)
+            if is_moore_lattice(self.data_handler):
+                self.population_holder.generate_neighbours()
+            else:
+                self.population_holder.generate_neighbours(shared_topology(self.data_handler))
+            self.topology_key = key
+        else:
+            self.population_holder.reset(self.data_handler)
+        self.tally = Tally(np.square(self.data_handler.population_size))
+        self.tally.infection(0, len(initial_cells(self.data_handler)))
+
+    def infected_present(self):
+        """Return True if any infected people are present, False otherwise"""
+        return self.tally.infected > 0
+
+    def infect(self):
+        """Let every contagious person try to infect their neighbours"""
+        current_day = self.data_handler.current_day
+        contagious = 0
+        attempted = 0
+        succeeded = 0
+        candidates = set()
+        for person in self.population_holder.population.flatten():
+
+            # The incubation time for an infected individual to start being contagious is 1 day.
+            # An infected individual cannot infect neighbours until after 1 day of getting infected.
+            if person.state == State.infected and person.day_of_infection < current_day:
+                contagious += 1
+
+                for neighbour in person.get_neighbours().flatten():
+                    # Person.infect does not draw for people that are not susceptible
+                    if neighbour.state != State.susceptible:
+                        continue
+                    attempted += 1
+                    candidates.add(neighbour.id)
+                    if neighbour.infect(self.data_handler.infection_probability,
+                                        current_day, self.data_handler.interval):
+                        succeeded += 1
+                        self.tally.infection(current_day)
+        self.counters = {'infections attempted': attempted, 'infections succeeded': succeeded,
+                         'active cells': contagious + len(candidates)}
+
+    def update(self):
+        """Update the status of each person after the entire population has been examined"""
+        current_day = self.data_handler.current_day
+        for person in self.population_holder.population.flatten():
+            transition = person.update(current_day, self.data_handler.mortality_probability)
+            if transition == State.immune:
+                self.tally.recovery(current_day, infected_today=person.day_of_infection == current_day)
+            elif transition == State.dead:
+                self.tally.death(current_day, infected_today=person.day_of_infection == current_day)
+
+    def census(self):
+        """Count susceptible, newly infected, sick, recovered and dead people for the current day"""
+        return self.tally.snapshot(self.data_handler.current_day)
+
+    def close(self):
+        """Release the resources of the engine. The object engine holds none"""
+
+    def state_grid(self):
+        """Return the state value of every person as an integer grid indexed by [x, y]"""
+        grid = np.empty(self.population_holder.population.shape, dtype=np.int8)
+        for person in self.population_holder.population.flatten():
+            grid[person.coordinates['x'], person.coordinates['y']] = person.state.value
+        return grid
+
+    def get_state(self):
+        """Return the people, counts and random state of the run so that it can be restored later.
+
+        The people are stored like a CompactPopulation, with -1 for days that have not happened.
+        """
+        shape = self.population_holder.population.shape
+        population = {field: np.full(shape, -1, dtype=np.int16) for field in POPULATION_FIELDS}
+        for person in self.population_holder.population.flatten():
+            x, y = person.coordinates['x'], person.coordinates['y']
+            population['state'][x, y] = person.state.value
+            for field in POPULATION_FIELDS[1:]:
+                value = getattr(person, field)
+                if value is not None:
+                    population[field][x, y] = value
+        name, keys, position, has_gauss, cached_gaussian = np.random.get_state()
+        random = {'name': name, 'keys': keys, 'position': position,
+                  'has_gauss': has_gauss, 'cached_gaussian': cached_gaussian}
+        return {'population': population, 'tally': self.tally.get_state(), 'random': random}
+
+    def set_state(self, state):
+        """Restore a state returned by get_state"""
+        self.reset()
+        population = state['population']
+        for person in self.population_holder.population.flatten():
+            x, y = person.coordinates['x'], person.coordinates['y']
+            person.state = State(int(population['state'][x, y]))
+            person.sick_days = int(population['sick_days'][x, y])
+            for field in POPULATION_FIELDS[2:]:
+                value = int(population[field][x, y])
+                setattr(person, field, None if value < 0 else value)
+        self.tally.set_state(state['tally'])
+        random = state['random']
+        np.random.set_state((random['name'], np.asarray(random['keys'], dtype=np.uint32), random['position'],
+                             random['has_gauss'], random['cached_gaussian']))
+
+
+class VectorizedEngine:
+    """Engine storing the population as integer arrays and updating the whole grid at once"""
+    # Largest number of neighbours of a cell
+    max_neighbours = 8
+
+    def __init__(self, data_handler):
+        self.data_handler = data_handler
+        self.population_holder = None
+        self.random = None
+        self.tally = None
+        # Infections attempted and succeeded and cells visited by the infection step of the current day
+        self.counters = {}
+
+    def reset(self):
+        """Clear the state arrays and place the initially infected people"""
+        self.random = create_random_stream(self.data_handler, self.data_handler.seed)
+        self.clear_population()
+        self.tally = Tally(np.square(self.data_handler.population_size))
+
+        initial = np.zeros(self.population_holder.state.shape, dtype=bool)
+        initial.reshape(-1)[initial_cells(self.data_handler)] = True
+        self.infect_cells(initial, 0)
+
+    def clear_population(self):
+        """Make every cell susceptible, reusing the arrays of the last run if the size did not change"""
+        population = self.population_holder
+        if population is None or population.population_size != self.data_handler.population_size:
+            self.population_holder = CompactPopulation(self.data_handler)
+        else:
+            check_compact_interval(self.data_handler.interval)
+            population.clear()
+
+    def infected_present(self):
+        """Return True if any infected people are present, False otherwise"""
+        return self.tally.infected > 0
+
+    def infect_cells(self, cells, current_day):
+        """Infect the cells selected by a boolean mask and draw their number of sick days"""
+        indices = np.flatnonzero(cells)
+        if len(indices) == 0:
+            return
+        interval = self.data_handler.interval
+        sick_days = self.random.integers(SICK_DAYS, current_day, indices,
+                                         interval['minDays'], interval['maxDays'] + 1)
+        self.population_holder.infect(cells, current_day, sick_days)
+        self.tally.infection(current_day, len(indices))
+
+    def infect(self):
+        """Infect susceptible cells based on the number of contagious neighbours"""
+        population = self.population_holder
+        current_day = self.data_handler.current_day
+        check_compact_day(current_day)
+        contagious = (population.state == State.infected.value) & (
+            population.day_of_infection < current_day)
+        pressure = self.pressure(contagious)
+
+        candidates = np.flatnonzero((population.state == State.susceptible.value) & (pressure > 0))
+        infected = np.zeros(pressure.shape, dtype=bool)
+        infected.reshape(-1)[candidates] = self.random.bernoulli(
+            INFECTION, current_day, candidates,
+            infection_chance(self.data_handler.infection_probability,
+                             self.max_neighbours)[pressure.reshape(-1)[candidates]])
+        self.infect_cells(infected, current_day)
+        self.counters = {'infections attempted': int(pressure.reshape(-1)[candidates].sum()),
+                         'infections succeeded': int(np.count_nonzero(infected)),
+                         'active cells': int(np.count_nonzero(contagious)) + len(candidates)}
+
+    def pressure(self, contagious):
+        """Count the contagious neighbours of every cell"""
+        return neighbour_count(contagious)
+
+    def update(self):
+        """Let infected cells recover or die"""
+        population = self.population_holder
+        current_day = self.data_handler.current_day
+        infected = population.state == State.infected.value
+        recovered = infected & (population.sick_days > 0) & (
+            current_day - population.day_of_infection >= population.sick_days)
+        population.state[recovered] = State.immune.value
+        population.day_of_immunity[recovered] = current_day
+        self.tally.recovery(current_day, np.count_nonzero(recovered))
+
+        mortality = self.data_handler.mortality_probability
+        if mortality > 0:
+            at_risk = np.flatnonzero(infected & ~recovered)
+            died = at_risk[self.random.bernoulli(MORTALITY, current_day, at_risk, mortality)]
+            population.state.reshape(-1)[died] = State.dead.value
+            population.day_of_death.reshape(-1)[died] = current_day
+            self.tally.death(current_day, len(died), np.count_nonzero(
+                population.day_of_infection.reshape(-1)[died] == current_day))
+
+    def census(self):
+        """Count susceptible, newly infected, sick, recovered and dead cells for the current day"""
+        return self.tally.snapshot(self.data_handler.current_day)
+
+    def state_grid(self):
+        """Return the state value of every cell as an integer grid indexed by [x, y]"""
+        return self.population_holder.state
+
+    def close(self):
+        """Release the resources of the engine. The array engines hold none"""
+
+    def get_state(self):
+        """Return the state arrays, counts and random state of the run so that it can be restored later"""
+        return {'population': self.population_holder.get_state(), 'tally': self.tally.get_state(),
+                'random': self.random.get_state()}
+
+    def set_state(self, state):
+        """Restore a state returned by get_state"""
+        self.random = create_random_stream(self.data_handler, self.data_handler.seed)
+        self.random.set_state(state['random'])
+        self.population_holder = CompactPopulation(self.data_handler)
+        self.population_holder.set_state(state['population'])
+        self.tally = Tally(0)
+        self.tally.set_state(state['tally'])
+
+
+class FrontierEngine(VectorizedEngine):
+    """Engine that only visits infected cells and their susceptible neighbours.
+
+    The infected cells are kept as a sorted list of flat indices into the grid, so a
+    day costs time proportional to the outbreak front instead of the whole grid.
+    Cells are visited in the same order as the vectorized engine, which makes both
+    engines draw the same random numbers for the same seed.
+    """
+
+    def __init__(self, data_handler):
+        super().__init__(data_handler)
+        self.infected = None
+        self.active_count = 0
+
+    def reset(self):
+        """Clear the state arrays and place the initially infected people"""
+        self.random = create_random_stream(self.data_handler, self.data_handler.seed)
+        self.clear_population()
+        size = self.population_holder.population_size
+        self.tally = Tally(size * size)
+        initial = initial_cells(self.data_handler)
+        self.infected = np.empty(0, dtype=np.int64)
+        self.active_count = len(initial)
+        self.infect_indices(initial, 0)
+
+    def flat(self, field):
+        """Return a flat view of one of the population arrays"""
+        return field.reshape(-1)
+
+    def infect_indices(self, cells, current_day):
+        """Infect the cells given by sorted flat indices and draw their number of sick days"""
+        if len(cells) == 0:
+            return
+        interval = self.data_handler.interval
+        population = self.population_holder
+        sick_days = self.random.integers(SICK_DAYS, current_day, cells,
+                                         interval['minDays'], interval['maxDays'] + 1)
+        self.flat(population.state)[cells] = State.infected.value
+        self.flat(population.day_of_infection)[cells] = current_day
+        self.flat(population.sick_days)[cells] = sick_days
+        self.infected = np.sort(np.concatenate((self.infected, cells)))
+        self.tally.infection(current_day, len(cells))
+
+    def infect(self):
+        """Infect susceptible neighbours of contagious cells"""
+        population = self.population_holder
+        current_day = self.data_handler.current_day
+        check_compact_day(current_day)
+        state = self.flat(population.state)
+        contagious = self.infected[self.flat(population.day_of_infection)[self.infected] < current_day]
+
+        targets = neighbour_indices(contagious, population.population_size).reshape(-1)
+        targets = targets[state[targets] == State.susceptible.value]
+        candidates, pressure = np.unique(targets, return_counts=True)
+        self.active_count = len(contagious) + len(candidates)
+
+        infected = self.random.bernoulli(
+            INFECTION, current_day, candidates,
+            infection_chance(self.data_handler.infection_probability)[pressure])
+        self.infect_indices(candidates[infected], current_day)
+        self.counters = {'infections attempted': len(targets), 'infections succeeded': int(np.count_nonzero(infected)),
+                         'active cells': self.active_count}
+
+    def update(self):
+        """Let infected cells recover or die"""
+        population = self.population_holder
+        current_day = self.data_handler.current_day
+        infected = self.infected
+        sick_days = self.flat(population.sick_days)[infected]
+        recovered = (sick_days > 0) & (
+            current_day - self.flat(population.day_of_infection)[infected] >= sick_days)
+        self.flat(population.state)[infected[recovered]] = State.immune.value
+        self.flat(population.day_of_immunity)[infected[recovered]] = current_day
+        self.tally.recovery(current_day, np.count_nonzero(recovered))
+
+        died = np.zeros_like(recovered)
+        mortality = self.data_handler.mortality_probability
+        if mortality > 0:
+            at_risk = ~recovered
+            died[at_risk] = self.random.bernoulli(
+                MORTALITY, current_day, infected[at_risk], mortality)
+            self.flat(population.state)[infected[died]] = State.dead.value
+            self.flat(population.day_of_death)[infected[died]] = current_day
+            self.tally.death(current_day, np.count_nonzero(died), np.count_nonzero(
+                self.flat(population.day_of_infection)[infected[died]] == current_day))
+        self.infected = infected[~(recovered | died)]
+
+    def get_state(self):
+        """Return the state arrays, infected cells, counts and random state of the run"""
+        state = super().get_state()
+        state['infected'] = self.infected.copy()
+        state['active_count'] = int(self.active_count)
+        return state
+
+    def set_state(self, state):
+        """Restore a state returned by get_state"""
+        super().set_state(state)
+        self.infected = np.asarray(state['infected'], dtype=np.int64)
+        self.active_count = state['active_count']
+
+
+class NetworkEngine(VectorizedEngine):
+    """Engine running the infection step on any contact network.
+
+    The number of contagious neighbours of every person is the product of the sparse
+    adjacency matrix of the network with the contagious indicator vector. People are
+    kept in the population_size x population_size arrays of the vectorized engine, so
+    on the radius 1 lattice both engines give the same results.
+    """
+
+    def __init__(self, data_handler):
+        super().__init__(data_handler)
+        self.topology = None
+        self.adjacency = None
+
+    def reset(self):
+        """Look up the contact network, clear the state arrays and place the initially infected people"""
+        self.topology = shared_topology(self.data_handler)
+        self.adjacency = self.topology.matrix()
+        self.max_neighbours = self.topology.max_degree()
+        super().reset()
+
+    def set_state(self, state):
+        """Look up the contact network and restore a state returned by get_state"""
+        self.topology = shared_topology(self.data_handler)
+        self.adjacency = self.topology.matrix()
+        self.max_neighbours = self.topology.max_degree()
+        super().set_state(state)
+
+    def pressure(self, contagious):
+        """Count the contagious neighbours of every person with a sparse matrix-vector product.
+
+        The network is undirected, so the product with the sparse indicator vector is the
+        sum of the rows of the contagious people, which only touches their edges.
+        """
+        rows = self.adjacency[np.flatnonzero(contagious)]
+        return np.bincount(rows.indices, minlength=self.topology.node_count).reshape(contagious.shape)
+
+
+class EventEngine(FrontierEngine):
+    """Engine scheduling the recovery or death of every cell at the day it gets infected.
+
+    The day of recovery follows from the sick days, and the daily mortality coin flips
+    until then are replaced by one geometric draw of the day of death, which has the
+    same distribution. Events are kept in buckets per day, a calendar queue, so the
+    update of a day only visits the cells with an event that day. Without mortality
+    the engine draws the same random numbers as the frontier engine.
+    """
+
+    def __init__(self, data_handler):
+        super().__init__(data_handler)
+        self.recoveries = {}
+        self.deaths = {}
+
+    def reset(self):
+        """Empty the calendar, allocate the state arrays and place the initially infected people"""
+        self.recoveries = {}
+        self.deaths = {}
+        super().reset()
+
+    def infect_indices(self, cells, current_day):
+        """Infect the cells given by sorted flat indices and schedule their recovery or death"""
+        super().infect_indices(cells, current_day)
+        if len(cells) > 0:
+            self.schedule(cells, current_day)
+
+    def schedule(self, cells, current_day):
+        """Put the recovery or death of newly infected cells in the calendar"""
+        sick_days = self.flat(self.population_holder.sick_days)[cells].astype(np.int64)
+        # Cells without sick days never recover, like in Person.update
+        days = np.where(sick_days > 0, current_day + sick_days, -1)
+        dies = np.zeros(len(cells), dtype=bool)
+        mortality = self.data_handler.mortality_probability
+        if mortality > 0:
+            # The coin flips start the day of infection and end the day before recovery
+            death_days = current_day + days_before_death(
+                self.random.uniform(MORTALITY, current_day, cells), mortality)
+            dies = (death_days < days) | (days < 0)
+            days = np.where(dies, death_days, days)
+        add_events(self.recoveries, days[~dies & (days >= 0)], cells[~dies & (days >= 0)])
+        add_events(self.deaths, days[dies], cells[dies])
+
+    def update(self):
+        """Let the infected cells with an event on the current day recover or die"""
+        population = self.population_holder
+        current_day = self.data_handler.current_day
+        recovered = pop_events(self.recoveries, current_day)
+        self.flat(population.state)[recovered] = State.immune.value
+        self.flat(population.day_of_immunity)[recovered] = current_day
+        self.tally.recovery(current_day, len(recovered))
+
+        died = pop_events(self.deaths, current_day)
+        if len(died) > 0:
+            self.flat(population.state)[died] = State.dead.value
+            self.flat(population.day_of_death)[died] = current_day
+            self.tally.death(current_day, len(died), np.count_nonzero(
+                self.flat(population.day_of_infection)[died] == current_day))
+        if len(recovered) + len(died) > 0:
+            self.infected = self.infected[self.flat(population.state)[self.infected] == State.infected.value]
+
+    def get_state(self):
+        """Return the state arrays, infected cells, calendar, counts and random state of the run"""
+        state = super().get_state()
+        state['recoveries'] = calendar_events(self.recoveries)
+        state['deaths'] = calendar_events(self.deaths)
+        return state
+
+    def set_state(self, state):
+        """Restore a state returned by get_state"""
+        super().set_state(state)
+        self.recoveries = {}
+        self.deaths = {}
+        add_events(self.recoveries, state['recoveries']['day'], state['recoveries']['cell'])
+        add_events(self.deaths, state['deaths']['day'], state['deaths']['cell'])
+
+
+class TiledEngine(VectorizedEngine):
+    """Engine splitting the torus into row strips that worker processes update in parallel.
+
+    The population arrays live in shared memory. Every day each worker infects the
+    cells of its strip, reading the contagious cells of its strip and of the row
+    above and below it, the one-cell halo owned by the neighbouring strips. After a
+    barrier each worker lets its infected cells recover or die and marks the cells
+    that will be contagious the next day. The counts of the strips are summed into
+    the tally of the engine.
+
+    Random numbers come from the counter stream keyed by cell, so the results do not
+    depend on the number of tiles and equal those of the vectorized engine.
+    """
+
+    def __init__(self, data_handler):
+        if data_handler.random_mode != 'counter':
+            raise ValueError("The tiled engine needs random_mode 'counter' to give the same results for any number of tiles")
+        super().__init__(data_handler)
+        self.memory = None
+        self.contagious = None
+        self.pool = None
+        self.bounds = None
+        # Parameters of the current run, sent to the workers with every job
+        self.run = 0
+        self.parameters = None
+        self.exit_registered = False
+
+    def reset(self):
+        """Clear the shared arrays and place the initially infected people.
+
+        The shared memory and the workers are kept while the population size and number
+        of tiles do not change, so only the first run of a size starts them.
+        """
+        check_compact_interval(self.data_handler.interval)
+        size = self.data_handler.population_size
+        tiles = min(max(1, self.data_handler.tiles), size)
+        if self.memory is None or self.population_holder.population_size != size or len(self.bounds) != tiles + 1:
+            self.close()
+            self.start(size, tiles)
+        self.population_holder.clear()
+        self.random = CounterStream(self.data_handler.seed)
+        self.tally = Tally(size * size)
+        self.run += 1
+        self.parameters = {
+            'run': self.run,
+            'seed': self.random.seed,
+            'infection_chance': infection_chance(self.data_handler.infection_probability),
+            'interval': self.data_handler.interval,
+            'mortality_probability': self.data_handler.mortality_probability
+        }
+
+        initial = np.zeros(self.population_holder.state.shape, dtype=bool)
+        initial.reshape(-1)[initial_cells(self.data_handler)] = True
+        self.infect_cells(initial, 0)
+        self.mark_contagious()
+
+    def start(self, size, tiles):
+        """Allocate the shared arrays and start the workers. They are released by close, at the latest at exit"""
+        self.memory = create_tile_memory(tile_buffer_size(size))
+        try:
+            self.population_holder, self.contagious = shared_population(tile_buffer(self.memory), size)
+            self.bounds = np.linspace(0, size, tiles + 1).astype(int)
+            # Workers attach to shared memory by its name and inherit a RawArray
+            handle = getattr(self.memory, 'name', self.memory)
+            self.pool = multiprocessing.Pool(tiles, initializer=init_tile_worker, initargs=(handle, size))
+        except BaseException:
+            self.close()
+            raise
+        if not self.exit_registered:
+            atexit.register(self.close)
+            self.exit_registered = True
+
+    def mark_contagious(self):
+        """Mark the cells that are contagious on the current day"""
+        population = self.population_holder
+        self.contagious[...] = (population.state == State.infected.value) & (
+            population.day_of_infection < self.data_handler.current_day)
+
+    def jobs(self, phase):
+        """Return the job of every strip for a phase of the current day"""
+        current_day = self.data_handler.current_day
+        return [(phase, start, stop, current_day, self.parameters)
+                for start, stop in zip(self.bounds[:-1], self.bounds[1:])]
+
+    def infect(self):
+        """Let the workers infect the susceptible cells of their strips"""
+        check_compact_day(self.data_handler.current_day)
+        attempted, infected, active = np.sum(self.pool.map(run_tile_job, self.jobs('infect')), axis=0)
+        self.tally.infection(self.data_handler.current_day, infected)
+        self.counters = {'infections attempted': int(attempted), 'infections succeeded': int(infected),
+                         'active cells': int(active)}
+
+    def update(self):
+        """Let the workers update the infected cells of their strips"""
+        counts = np.sum(self.pool.map(run_tile_job, self.jobs('update')), axis=0)
+        current_day = self.data_handler.current_day
+        self.tally.recovery(current_day, counts[0])
+        self.tally.death(current_day, counts[1], counts[2])
+
+    def set_state(self, state):
+        """Restore a state returned by get_state"""
+        self.reset()
+        self.population_holder.set_state(state['population'])
+        self.tally.set_state(state['tally'])
+        self.mark_contagious()
+
+    def close(self):
+        """Stop the workers and release the shared memory. The population is gone afterwards, get_state copies it out"""
+        # The arrays point into the shared memory, which can only be closed once they are gone
+        self.population_holder = None
+        self.contagious = None
+        self.bounds = None
+        pool, self.pool = self.pool, None
+        memory, self.memory = self.memory, None
+        try:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        finally:
+            # A RawArray is freed with its last reference
+            if hasattr(memory, 'unlink'):
+                memory.close()
+                memory.unlink()
+
+
+class EnsembleEngine:
+    """Engine advancing the grids of many seeds at once as one (seeds, size, size) stack.
+
+    Every replicate draws from its own random stream in the same order as the
+    vectorized engine, so a replicate gives the same series as a single run with
+    its seed. Replicates without infected cells are retired from the stack.
+    """
+
+    def __init__(self, data_handler, seeds):
+        if not is_moore_lattice(data_handler):
+            raise ValueError("The ensemble engine only runs on the radius 1 lattice")
+        self.data_handler = data_handler
+        self.seeds = list(seeds)
+        self.randoms = None
+        self.ids = None
+        self.tally = None
+        self.truncated = None
+        self.state = None
+        self.sick_days = None
+        self.day_of_infection = None
+        self.day_of_death = None
+        self.day_of_immunity = None
+
+    def reset(self):
+        """Allocate the stacked state arrays and place the initially infected people in every replicate"""
+        check_compact_interval(self.data_handler.interval)
+        size = self.data_handler.population_size
+        shape = (len(self.seeds), size, size)
+        self.randoms = [create_random_stream(self.data_handler, seed) for seed in self.seeds]
+        self.ids = np.arange(len(self.seeds))
+        self.truncated = np.zeros(len(self.seeds), dtype=bool)
+        self.tally = Tally(np.full(len(self.seeds), size * size, dtype=np.int64))
+        self.state = np.full(shape, State.susceptible.value, dtype=np.int8)
+        self.sick_days = np.zeros(shape, dtype=np.int8)
+        self.day_of_infection = np.full(shape, -1, dtype=np.int16)
+        self.day_of_death = np.full(shape, -1, dtype=np.int16)
+        self.day_of_immunity = np.full(shape, -1, dtype=np.int16)
+
+        initial = np.zeros(shape, dtype=bool)
+        initial.reshape(len(self.seeds), -1)[:, initial_cells(self.data_handler)] = True
+        self.infect_cells(initial, 0)
+        if not initial.any():
+            # Nothing to simulate, like a single run without infected people
+            self.retire()
+
+    def infected_present(self):
+        """Return True if any replicate still has infected people, False otherwise"""
+        return len(self.ids) > 0
+
+    def split(self, cells):
+        """Return the replicate and flat index of the selected cells and where each replicate starts"""
+        replicates, indices = np.nonzero(cells.reshape(len(self.ids), -1))
+        bounds = np.searchsorted(replicates, np.arange(len(self.ids) + 1))
+        return replicates, indices, bounds
+
+    def count(self, cells):
+        """Count the selected cells of each replicate"""
+        return np.count_nonzero(cells, axis=(1, 2))
+
+    def draw(self, cells, method, purpose, current_day, *args):
+        """Draw one value per selected cell from the random stream of each replicate in turn"""
+        replicates, indices, bounds = self.split(cells)
+        return np.concatenate([getattr(self.randoms[i], method)(purpose, current_day, indices[start:stop], *args)
+                               for i, start, stop in zip(self.ids, bounds[:-1], bounds[1:])])
+
+    def infect_cells(self, cells, current_day):
+        """Infect the cells selected by a boolean mask and draw their number of sick days"""
+        if not cells.any():
+            return
+        interval = self.data_handler.interval
+        self.state[cells] = State.infected.value
+        self.day_of_infection[cells] = current_day
+        self.sick_days[cells] = self.draw(
+            cells, 'integers', SICK_DAYS, current_day, interval['minDays'], interval['maxDays'] + 1)
+        self.tally.infection(current_day, self.count(cells))
+
+    def infect(self):
+        """Infect susceptible cells in every replicate based on the number of contagious neighbours"""
+        current_day = self.data_handler.current_day
+        check_compact_day(current_day)
+        contagious = (self.state == State.infected.value) & (
+            self.day_of_infection < current_day)
+        pressure = neighbour_count(contagious)
+
+        candidates = (self.state == State.susceptible.value) & (pressure > 0)
+        infected = np.zeros_like(candidates)
+        infected[candidates] = self.draw(candidates, 'uniform', INFECTION, current_day) < infection_chance(
+            self.data_handler.infection_probability)[pressure[candidates]]
+        self.infect_cells(infected, current_day)
+
+    def update(self):
+        """Let infected cells recover or die in every replicate"""
+        current_day = self.data_handler.current_day
+        infected = self.state == State.infected.value
+        recovered = infected & (self.sick_days > 0) & (
+            current_day - self.day_of_infection >= self.sick_days)
+        self.state[recovered] = State.immune.value
+        self.day_of_immunity[recovered] = current_day
+        self.tally.recovery(current_day, self.count(recovered))
+
+        mortality = self.data_handler.mortality_probability
+        if mortality > 0:
+            at_risk = infected & ~recovered
+            died = np.zeros_like(at_risk)
+            died[at_risk] = self.draw(at_risk, 'bernoulli', MORTALITY, current_day, mortality)
+            self.state[died] = State.dead.value
+            self.day_of_death[died] = current_day
+            self.tally.death(current_day, self.count(died), self.count(
+                died & (self.day_of_infection == current_day)))
+
+    def analyze(self):
+        """Save the counts of the current day for every replicate in the ensemble series and retire the finished ones"""
+        current_day = self.data_handler.current_day
+        series = self.data_handler.ensemble_series
+        series.record(self.ids, current_day, self.tally.snapshot(current_day))
+        active = self.tally.infected > 0
+        if self.data_handler.classify_only:
+            # In classification mode a replicate is over once it is known to be an epidemic
+            decided = active & (series.data[self.ids, current_day, ACC_INFECTED] > self.data_handler.epidemic_size())
+            self.truncated[self.ids[decided]] = True
+            active &= ~decided
+        self.retire(active)
+
+    def retire(self, active=None):
+        """Remove the replicates without infected people, or those not marked active, from the stack"""
+        if active is None:
+            active = self.tally.infected > 0
+        if not active.all():
+            self.ids = self.ids[active]
+            self.tally.select(active)
+            self.state = self.state[active]
+            self.sick_days = self.sick_days[active]
+            self.day_of_infection = self.day_of_infection[active]
+            self.day_of_death = self.day_of_death[active]
+            self.day_of_immunity = self.day_of_immunity[active]
+
+
+def infection_chance(infection_probability, max_neighbours=8):
+    """Return the chance of infection for a cell with 0 to max_neighbours contagious neighbours.
+
+    Every contagious neighbour is an independent attempt, so a cell with k
+    contagious neighbours escapes infection with probability (1 - p)^k.
+    """
+    return 1.0 - np.power(1.0 - infection_probability, np.arange(max_neighbours + 1))
+
+
+# Offsets of the 8 closest neighbours in the order used by Population.generate_neighbours
+NEIGHBOUR_OFFSETS = [(1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, -1), (-1, 1)]
+
+
+def neighbour_count(cells):
+    """Count the marked cells among the 8 closest neighbours on the torus, as in Population.generate_neighbours.
+
+    The grid is the last two axes, so a stack of replicate grids is counted at once.
+    """
+    cells = cells.astype(np.int8)
+    # Sum the column of three cells around each cell, then the row of three columns
+    columns = cells + np.roll(cells, 1, axis=-1) + np.roll(cells, -1, axis=-1)
+    return columns + np.roll(columns, 1, axis=-2) + np.roll(columns, -1, axis=-2) - cells
+
+
+def neighbour_indices(cells, population_size):
+    """Return the flat indices of the 8 closest neighbours on the torus for each flat cell index"""
+    x, y = np.divmod(cells, population_size)
+    neighbours = np.empty((len(cells), 8), dtype=np.int64)
+    for i, (dx, dy) in enumerate(NEIGHBOUR_OFFSETS):
+        neighbours[:, i] = (x + dx) % population_size * population_size + (y + dy) % population_size
+    return neighbours
+
+
+def days_before_death(uniform, mortality_probability):
+    """Turn uniform numbers into the number of days survived with a daily chance of death.
+
+    Inverse transform sampling of the geometric distribution counting the failed coin
+    flips before the first death.
+    """
+    if mortality_probability >= 1:
+        return np.zeros(len(uniform), dtype=np.int64)
+    return np.floor(np.log1p(-uniform) / np.log1p(-mortality_probability)).astype(np.int64)
+
+
+def add_events(calendar, days, cells):
+    """Add the events of cells to the buckets of their days in a calendar"""
+    order = np.argsort(days, kind='stable')
+    event_days, starts = np.unique(days[order], return_index=True)
+    for event_day, group in zip(event_days, np.split(np.asarray(cells, dtype=np.int64)[order], starts[1:])):
+        calendar.setdefault(int(event_day), []).append(group)
+
+
+def pop_events(calendar, current_day):
+    """Remove the bucket of a day from a calendar and return its cells"""
+    bucket = calendar.pop(current_day, None)
+    if bucket is None:
+        return np.empty(0, dtype=np.int64)
+    return np.concatenate(bucket)
+
+
+def calendar_events(calendar):
+    """Return the days and cells of all events in a calendar as arrays"""
+    days = [np.full(len(group), event_day, dtype=np.int64) for event_day, bucket in calendar.items() for group in bucket]
+    cells = [group for bucket in calendar.values() for group in bucket]
+    return {'day': np.concatenate(days) if days else np.empty(0, dtype=np.int64),
+            'cell': np.concatenate(cells) if cells else np.empty(0, dtype=np.int64)}
+
+
+def tile_buffer_size(population_size):
+    """Return the size of the shared memory of the tiled engine: the population and the contagious marks"""
+    return CompactPopulation.buffer_size(population_size) + population_size * population_size
+
+
+def create_tile_memory(size):
+    """Allocate size bytes of memory to share with the tile workers.
+
+    SharedMemory only exists from Python 3.8. Older versions get a RawArray, which the
+    workers inherit when the pool starts them.
+    """
+    try:
+        from multiprocessing import shared_memory
+    except ImportError:
+        return multiprocessing.RawArray('B', size)
+    return shared_memory.SharedMemory(create=True, size=size)
+
+
+def tile_buffer(memory):
+    """Return the buffer of the memory of the tile workers"""
+    return memory.buf if hasattr(memory, 'buf') else memoryview(memory).cast('B')
+
+
+def shared_population(buffer, population_size):
+    """Return the population and the contagious marks stored in the shared memory of the tiled engine"""
+    population = CompactPopulation.from_buffer(population_size, buffer)
+    contagious = np.ndarray((population_size, population_size), dtype=bool, buffer=buffer,
+                            offset=CompactPopulation.buffer_size(population_size))
+    return population, contagious
+
+
+# Shared memory, population and contagious marks of a tile worker process, set by init_tile_worker
+tile_memory = None
+tile_population = None
+tile_contagious = None
+# Parameters of the run the worker last got a job of
+tile_parameters = None
+
+
+def init_tile_worker(handle, population_size):
+    """Attach the worker process to the memory of the tiled engine, given by the name of the shared memory or a RawArray"""
+    global tile_memory, tile_population, tile_contagious
+    if isinstance(handle, str):
+        from multiprocessing import shared_memory
+        tile_memory = shared_memory.SharedMemory(name=handle)
+    else:
+        tile_memory = handle
+    tile_population, tile_contagious = shared_population(tile_buffer(tile_memory), population_size)
+
+
+def run_tile_job(job):
+    """Run one phase of a day on the strip of rows [start, stop)"""
+    global tile_parameters
+    phase, start, stop, current_day, parameters = job
+    if tile_parameters is None or tile_parameters['run'] != parameters['run']:
+        tile_parameters = dict(parameters, random=CounterStream(parameters['seed']))
+    if phase == 'infect':
+        return infect_tile(start, stop, current_day)
+    return update_tile(start, stop, current_day)
+
+
+def infect_tile(start, stop, current_day):
+    """Infect the susceptible cells of a strip.
+
+    Returns the number of infections attempted, the number of infected cells and the
+    number of contagious and candidate cells.
+    """
+    population = tile_population
+    size = population.population_size
+    random = tile_parameters['random']
+    # The strip with its halo rows, so the rolls of neighbour_count find every neighbour
+    rows = np.arange(start - 1, stop + 1) % size
+    pressure = neighbour_count(tile_contagious[rows])[1:-1]
+
+    state = population.state[start:stop].reshape(-1)
+    candidates = np.flatnonzero((state == State.susceptible.value) & (pressure.reshape(-1) > 0))
+    cells = start * size + candidates
+    infected = random.bernoulli(INFECTION, current_day, cells,
+                                tile_parameters['infection_chance'][pressure.reshape(-1)[candidates]])
+    counts = (int(pressure.reshape(-1)[candidates].sum()), int(np.count_nonzero(infected)),
+              int(np.count_nonzero(tile_contagious[start:stop])) + len(candidates))
+    candidates, cells = candidates[infected], cells[infected]
+    if len(cells) == 0:
+        return counts
+    interval = tile_parameters['interval']
+    population.sick_days[start:stop].reshape(-1)[candidates] = random.integers(
+        SICK_DAYS, current_day, cells, interval['minDays'], interval['maxDays'] + 1)
+    population.day_of_infection[start:stop].reshape(-1)[candidates] = current_day
+    state[candidates] = State.infected.value
+    return counts
+
+
+def update_tile(start, stop, current_day):
+    """Let the infected cells of a strip recover or die and mark the cells contagious the next day.
+
+    Returns the number of recovered cells, dead cells and dead cells that got infected the same day.
+    """
+    population = tile_population
+    size = population.population_size
+    state = population.state[start:stop].reshape(-1)
+    day_of_infection = population.day_of_infection[start:stop].reshape(-1)
+    sick_days = population.sick_days[start:stop].reshape(-1)
+
+    infected = state == State.infected.value
+    recovered = infected & (sick_days > 0) & (current_day - day_of_infection >= sick_days)
+    state[recovered] = State.immune.value
+    population.day_of_immunity[start:stop].reshape(-1)[recovered] = current_day
+
+    died = np.empty(0, dtype=np.int64)
+    mortality = tile_parameters['mortality_probability']
+    if mortality > 0:
+        at_risk = np.flatnonzero(infected & ~recovered)
+        died = at_risk[tile_parameters['random'].bernoulli(MORTALITY, current_day, start * size + at_risk, mortality)]
+        state[died] = State.dead.value
+        population.day_of_death[start:stop].reshape(-1)[died] = current_day
+
+    # Every cell still infected got infected today at the latest, so it is contagious tomorrow
+    tile_contagious[start:stop] = population.state[start:stop] == State.infected.value
+    return (int(np.count_nonzero(recovered)), len(died),
+            int(np.count_nonzero(day_of_infection[died] == current_day)))
+
+
+ENGINES = {
+    'object': ObjectEngine,
+    'vectorized': VectorizedEngine,
+    'frontier': FrontierEngine,
+    'event': EventEngine,
+    'network': NetworkEngine,
+    'tiled': TiledEngine
+}
+
+
+def engine_class(data_handler):
+    """Return the class of the simulation engine selected in the data handler"""
+    try:
+        selected = ENGINES[data_handler.engine]
+    except KeyError:
+        raise ValueError("Unknown simulation engine: %s" % data_handler.engine)
+    if selected not in (ObjectEngine, NetworkEngine) and not is_moore_lattice(data_handler):
+        raise ValueError("The %s engine only runs on the radius 1 lattice" % data_handler.engine)
+    return selected
+
+
+def create_engine(data_handler):
+    """Create the simulation engine selected in the data handler"""
+    return engine_class(data_handler)(data_handler)
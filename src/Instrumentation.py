@@ -0,0 +1,206 @@
+import cProfile
+import contextlib
+import json
+import os
+import sys
+import time
+
+
+class Hook:
+    """Callbacks of the instrumentation. Subclasses override the moments they need"""
+
+    def start_day(self, instrumentation, current_day):
+        """Called before the first phase of a day"""
+
+    def end_day(self, instrumentation, current_day):
+        """Called after the last phase of a day"""
+
+    def start_phase(self, instrumentation, name):
+        """Called when a phase starts"""
+
+    def end_phase(self, instrumentation, name):
+        """Called when a phase ends"""
+
+
+class ProfileHook(Hook):
+    """Run cProfile on selected days and save the statistics as <directory>/<seed>.<day>.prof.
+
+    With phases given, only those phases of the days are profiled.
+    """
+
+    def __init__(self, days, directory, phases=None):
+        self.days = set(days)
+        self.directory = directory
+        self.phases = None if phases is None else set(phases)
+        self.profile = None
+
+    def start_day(self, instrumentation, current_day):
+        if current_day in self.days:
+            self.profile = cProfile.Profile()
+            if self.phases is None:
+                self.profile.enable()
+
+    def end_day(self, instrumentation, current_day):
+        if self.profile is None:
+            return
+        self.profile.disable()
+        os.makedirs(self.directory, exist_ok=True)
+        self.profile.dump_stats(os.path.join(
+            self.directory, str(instrumentation.seed) + '.' + str(current_day) + '.prof'))
+        self.profile = None
+
+    def start_phase(self, instrumentation, name):
+        if self.profile is not None and self.phases is not None and name in self.phases:
+            self.profile.enable()
+
+    def end_phase(self, instrumentation, name):
+        if self.profile is not None and self.phases is not None and name in self.phases:
+            self.profile.disable()
+
+
+class Instrumentation:
+    """Timers and counters of the phases of every day and run of a simulation.
+
+    Phases are timed with the monotonic perf_counter clock and counters are summed per
+    day and per run. With a trace path, every day and run is appended to it as a line
+    of JSON. The trace is opened at the start of a run and closed at its end. Hooks are
+    called at the start and end of every day and phase.
+    """
+
+    def __init__(self, trace_path=None):
+        self.trace_path = trace_path
+        # Descriptor of the trace while a run is traced
+        self.trace_file = None
+        self.hooks = []
+        self.seed = None
+        self.prob = None
+        self.current_day = None
+        self.day_seconds = {}
+        self.day_counters = {}
+        self.run_seconds = {}
+        self.run_counters = {}
+        self.days = 0
+
+    def add_hook(self, hook):
+        """Add a Hook to call during the runs"""
+        self.hooks.append(hook)
+
+    def start_run(self, seed, prob):
+        """Start the timers and counters of a run"""
+        self.seed = seed
+        self.prob = prob
+        self.day_seconds = {}
+        self.day_counters = {}
+        self.run_seconds = {}
+        self.run_counters = {}
+        self.days = 0
+        self.close()
+        if self.trace_path is not None:
+            directory = os.path.dirname(self.trace_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.trace_file = os.open(self.trace_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o666)
+
+    def start_day(self, current_day):
+        """Start the timers and counters of a day"""
+        self.current_day = current_day
+        self.day_seconds = {}
+        self.day_counters = {}
+        for hook in self.hooks:
+            hook.start_day(self, current_day)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time the block of a phase and add it to the day and the run"""
+        for hook in self.hooks:
+            hook.start_phase(self, name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.day_seconds[name] = self.day_seconds.get(name, 0.0) + elapsed
+            self.run_seconds[name] = self.run_seconds.get(name, 0.0) + elapsed
+            for hook in self.hooks:
+                hook.end_phase(self, name)
+
+    def count(self, name, value):
+        """Add a value to a counter of the day and the run"""
+        self.day_counters[name] = self.day_counters.get(name, 0) + value
+        self.run_counters[name] = self.run_counters.get(name, 0) + value
+
+    def end_day(self):
+        """Finish the day and write it to the trace"""
+        for hook in self.hooks:
+            hook.end_day(self, self.current_day)
+        self.days += 1
+        self.write({'event': 'day', 'prob': self.prob, 'seed': self.seed, 'day': self.current_day,
+                    'seconds': self.day_seconds, 'counters': self.day_counters})
+
+    def end_run(self):
+        """Finish the run and write its totals to the trace. Returns the totals"""
+        data = {'event': 'run', 'prob': self.prob, 'seed': self.seed, 'days': self.days,
+                'seconds': self.run_seconds, 'counters': self.run_counters}
+        self.write(data)
+        self.close()
+        return data
+
+    def write(self, record):
+        """Append a record to the trace as one line of JSON"""
+        if self.trace_file is None:
+            return
+        # One unbuffered append per line keeps the lines of parallel workers apart
+        os.write(self.trace_file, (json.dumps(record, default=int) + '\n').encode('utf-8'))
+
+    def close(self):
+        """Close the trace of the current run, if it is open"""
+        if self.trace_file is not None:
+            os.close(self.trace_file)
+            self.trace_file = None
+
+
+def read_trace(path):
+    """Read the records of a trace"""
+    with open(path) as trace_file:
+        return [json.loads(line) for line in trace_file if line.strip()]
+
+
+def summarize_trace(path, slowest=5):
+    """Summarize a trace: total and mean time per phase, share of the run time, counter totals and the slowest days"""
+    records = read_trace(path)
+    runs = [record for record in records if record['event'] == 'run']
+    days = [record for record in records if record['event'] == 'day']
+    seconds = {}
+    counters = {}
+    for run in runs:
+        for name, value in run['seconds'].items():
+            seconds[name] = seconds.get(name, 0.0) + value
+        for name, value in run['counters'].items():
+            counters[name] = counters.get(name, 0) + value
+    total = sum(seconds.values())
+    day_count = sum(run['days'] for run in runs)
+    data = {
+        'runs': len(runs),
+        'days': day_count,
+        'seconds': total,
+        'phases': {name: {'seconds': value,
+                          'share': value / total if total > 0 else 0.0,
+                          'per day': value / day_count if day_count > 0 else 0.0}
+                   for name, value in sorted(seconds.items(), key=lambda item: -item[1])},
+        'counters': counters,
+        'slowest days': sorted(({'prob': day['prob'], 'seed': day['seed'], 'day': day['day'],
+                                 'seconds': sum(day['seconds'].values())} for day in days),
+                               key=lambda day: -day['seconds'])[:slowest]
+    }
+    return data
+
+
+if __name__ == "__main__":
+    summary = summarize_trace(sys.argv[1])
+    print("Runs:", summary['runs'], "days:", summary['days'], "seconds:", round(summary['seconds'], 3))
+    for name, phase in summary['phases'].items():
+        print("%-12s %10.3f s %6.1f %% %10.6f s/day" % (name, phase['seconds'], 100 * phase['share'], phase['per day']))
+    for name, value in summary['counters'].items():
+        print("%-24s %d" % (name, value))
+    for day in summary['slowest days']:
+        print("Slow day: probability", day['prob'], "seed", day['seed'], "day", day['day'], round(day['seconds'], 6), "s")
@@ -160,7 +160,7 @@ def user_input():
             visualize = input(
                 "Do you want to visualize the simulation, y/n?: ")
             if visualize == "y":
-                data_handler.visualize = 1
+                data_handler.visualize = 2
                 print("Visualization enabled.\n")
                 break
             elif visualize == "n":
@@ -237,7 +237,8 @@ def user_input():
             print('Invalid value. Program exited.')
 
 
-print("Welcome to epidemic simulation 1.0.")
-print("Please enter parameter values followed by enter, or just press enter to use default values.\n")
+if __name__ == "__main__":
+    print("Welcome to epidemic simulation 1.0.")
+    print("Please enter parameter values followed by enter, or just press enter to use default values.\n")
 
-user_input()
+    user_input()
@@ -0,0 +1,146 @@
+from ResultStore import ResultStore
+import atexit
+import os
+import queue
+import threading
+
+
+class OutputWriter:
+    """Write run results and images from a background thread.
+
+    Finished results are put on a bounded queue, so the simulation only waits for the
+    disk when it is more than queue_size jobs ahead. The writer thread takes up to
+    batch_size jobs at a time and appends all records for the same result store with
+    one open. Directories are created by the submitting thread, once per path, before
+    the first job for them is queued, so processes writing to the same directories do
+    not race on creating them.
+    """
+
+    def __init__(self, queue_size=64, batch_size=32):
+        self.jobs = queue.Queue(queue_size)
+        self.batch_size = batch_size
+        self.directories = set()
+        self.error = None
+        self.lock = threading.Lock()
+        self.bytes_written = 0
+        self.pid = os.getpid()
+        self.closed = False
+        self.thread = threading.Thread(target=self.write_jobs, daemon=True)
+        self.thread.start()
+
+    def makedirs(self, path):
+        """Create a directory unless this writer already did"""
+        if path and path not in self.directories:
+            os.makedirs(path, exist_ok=True)
+            self.directories.add(path)
+
+    def submit(self, kind, path, payload):
+        """Queue a job, waiting while the queue is full"""
+        self.raise_error()
+        if self.closed:
+            raise ValueError("The output writer is closed")
+        self.makedirs(os.path.dirname(path))
+        self.jobs.put((kind, path, payload))
+
+    def write_csv(self, path, frame):
+        """Queue a DataFrame to write as a csv file. The frame must not change afterwards"""
+        self.submit('csv', path, frame)
+
+    def write_bytes(self, path, data):
+        """Queue bytes, such as an encoded image, to write as a file"""
+        self.submit('bytes', path, data)
+
+    def append_store(self, path, prob, seed, values, metrics, params=None):
+        """Queue the series of a run to append to a result store. The values must not change afterwards"""
+        self.submit('store', path, (prob, seed, values, metrics, params))
+
+    def write_jobs(self):
+        """Write batches of queued jobs until the writer is closed"""
+        while True:
+            jobs = [self.jobs.get()]
+            while len(jobs) < self.batch_size and jobs[-1] is not None:
+                try:
+                    jobs.append(self.jobs.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                if self.error is None:
+                    self.write_batch([job for job in jobs if job is not None])
+            except Exception as error:
+                self.error = error
+            finally:
+                for _ in jobs:
+                    self.jobs.task_done()
+            if jobs[-1] is None:
+                return
+
+    def write_batch(self, jobs):
+        """Write a batch of jobs, appending the records of each result store at once"""
+        written = 0
+        records = {}
+        for kind, path, payload in jobs:
+            if kind == 'store':
+                records.setdefault(path, []).append(payload)
+                continue
+            if kind == 'csv':
+                payload.to_csv(path)
+                written += os.path.getsize(path)
+            else:
+                with open(path, 'wb') as output_file:
+                    written += output_file.write(payload)
+        for path, runs in records.items():
+            written += ResultStore(path).extend(runs)
+        with self.lock:
+            self.bytes_written += written
+
+    def take_bytes_written(self):
+        """Return the number of bytes written since the last call"""
+        with self.lock:
+            written = self.bytes_written
+            self.bytes_written = 0
+        return written
+
+    def raise_error(self):
+        """Raise the error of a failed write, once"""
+        error = self.error
+        if error is not None:
+            self.error = None
+            raise error
+
+    def flush(self):
+        """Wait until every queued job is written"""
+        if not self.closed:
+            self.jobs.join()
+        self.raise_error()
+
+    def close(self):
+        """Write the remaining jobs and stop the writer thread"""
+        if self.closed or self.pid != os.getpid():
+            return
+        self.closed = True
+        self.jobs.put(None)
+        self.thread.join()
+        self.raise_error()
+
+
+# Writer of the current process, created on first use
+writer = None
+
+
+def output_writer():
+    """Return the output writer of the current process.
+
+    A forked process does not have the thread of its parent's writer, so it gets its own.
+    The writer is closed at exit, which writes what is left in the queue.
+    """
+    global writer
+    if writer is None or writer.pid != os.getpid() or writer.closed:
+        writer = OutputWriter()
+        atexit.register(writer.close)
+    return writer
+
+
+def flush_output():
+    """Wait until the output writer of the current process has written every queued job"""
+    if writer is not None and writer.pid == os.getpid():
+        writer.flush()
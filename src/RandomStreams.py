@@ -0,0 +1,116 @@
+import numpy as np
+
+# Purposes of the random draws. Counter based streams key every draw by its purpose,
+# so the draws for infections, sick days and deaths never overlap.
+INFECTION = 0
+SICK_DAYS = 1
+MORTALITY = 2
+
+
+class RandomStream:
+    """Per-run stream of random numbers from a numpy Generator, drawn in blocks.
+
+    Draws are handed out in the order they are requested, so the engines must visit
+    cells in the same order to get the same results. The day and cells of a request
+    only determine how many numbers are drawn.
+    """
+
+    def __init__(self, seed, block_size=65536):
+        self.seed = seed
+        self.block_size = block_size
+        self.generator = np.random.Generator(np.random.PCG64(seed))
+        self.block = np.empty(0)
+        self.position = 0
+        # State of the generator before it drew the current block
+        self.block_state = self.generator.bit_generator.state
+
+    def random(self, size):
+        """Return the next size uniform numbers in [0, 1) of the stream"""
+        out = np.empty(size)
+        filled = 0
+        while filled < size:
+            if self.position == len(self.block):
+                self.block_state = self.generator.bit_generator.state
+                self.block = self.generator.random(self.block_size)
+                self.position = 0
+            count = min(size - filled, len(self.block) - self.position)
+            out[filled:filled + count] = self.block[self.position:self.position + count]
+            self.position += count
+            filled += count
+        return out
+
+    def uniform(self, purpose, current_day, cells):
+        """Return one uniform number in [0, 1) for each cell"""
+        return self.random(len(cells))
+
+    def bernoulli(self, purpose, current_day, cells, probability):
+        """Return one coin flip for each cell, True with the given probability"""
+        return self.uniform(purpose, current_day, cells) < probability
+
+    def integers(self, purpose, current_day, cells, low, high):
+        """Return one integer in [low, high) for each cell"""
+        return low + np.floor(self.uniform(purpose, current_day, cells) * (high - low)).astype(np.int64)
+
+    def get_state(self):
+        """Return the state of the stream so that it can be restored later.
+
+        The block is not saved. It is drawn again from the generator state it was drawn from.
+        """
+        return {'generator': self.block_state, 'drawn': len(self.block), 'position': self.position}
+
+    def set_state(self, state):
+        """Restore a state returned by get_state"""
+        self.generator.bit_generator.state = state['generator']
+        self.block_state = state['generator']
+        self.block = self.generator.random(state['drawn']) if state['drawn'] > 0 else np.empty(0)
+        self.position = int(state['position'])
+
+
+class CounterStream(RandomStream):
+    """Counter based random numbers keyed by (seed, purpose, day, cell).
+
+    Every draw is a hash of its key, so the result does not depend on the order in
+    which cells are visited. Engines and workers that split the grid differently
+    get the same numbers for the same seed.
+    """
+
+    def __init__(self, seed):
+        if seed is None:
+            seed = np.random.SeedSequence().entropy % 2 ** 64
+        self.seed = seed
+        self.key = splitmix64(np.array([seed], dtype=np.uint64))[0]
+
+    def uniform(self, purpose, current_day, cells):
+        """Return one uniform number in [0, 1) for each cell, determined by its key"""
+        cells = np.asarray(cells, dtype=np.uint64)
+        counter = (np.uint64(purpose) << np.uint64(56)) | (np.uint64(current_day) << np.uint64(36))
+        bits = splitmix64(splitmix64((cells + counter) ^ self.key) + self.key)
+        # Use the upper 53 bits as the mantissa of a double in [0, 1)
+        return (bits >> np.uint64(11)) * (1.0 / 9007199254740992.0)
+
+    def get_state(self):
+        """Return the state of the stream so that it can be restored later"""
+        return {'seed': int(self.seed)}
+
+    def set_state(self, state):
+        """Counter based streams have no state besides the seed"""
+        self.seed = state['seed']
+        self.key = splitmix64(np.array([self.seed], dtype=np.uint64))[0]
+
+
+def splitmix64(values):
+    """Mix 64 bit integers with the SplitMix64 finalizer"""
+    with np.errstate(over='ignore'):
+        values = values + np.uint64(0x9E3779B97F4A7C15)
+        values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return values ^ (values >> np.uint64(31))
+
+
+def create_random_stream(data_handler, seed):
+    """Create the random stream selected in the data handler for a run with the given seed"""
+    if data_handler.random_mode == 'stream':
+        return RandomStream(seed)
+    if data_handler.random_mode == 'counter':
+        return CounterStream(seed)
+    raise ValueError("Unknown random mode: %s" % data_handler.random_mode)
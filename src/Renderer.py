@@ -0,0 +1,122 @@
+from DataModels import State
+import numpy as np
+import os
+import queue
+import struct
+import threading
+import zlib
+
+# Colour of each state, indexed by State value, matching the scatter plot of Simulation.visualize_results
+COLOURS = np.zeros((len(State), 3), dtype=np.uint8)
+COLOURS[State.susceptible.value] = (0, 128, 0)
+COLOURS[State.infected.value] = (255, 0, 0)
+COLOURS[State.immune.value] = (0, 0, 255)
+COLOURS[State.dead.value] = (0, 0, 0)
+
+# Size of the header of a frame stack file, so it can be rewritten in place with the final frame count
+STACK_HEADER_SIZE = 256
+
+
+def render(state_grid, scale=1):
+    """Map a state grid indexed by [x, y] to an RGB image with y pointing up, scaled by nearest neighbour"""
+    image = COLOURS[state_grid.T[::-1]]
+    if scale > 1:
+        image = np.repeat(np.repeat(image, scale, axis=0), scale, axis=1)
+    return image
+
+
+def encode_png(image, level=1):
+    """Encode an RGB image as PNG bytes"""
+    height, width, _ = image.shape
+    # Every row starts with the filter type, 0 means the row is stored as is
+    rows = np.zeros((height, width * 3 + 1), dtype=np.uint8)
+    rows[:, 1:] = image.reshape(height, -1)
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    return (b'\x89PNG\r\n\x1a\n' +
+            chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) +
+            chunk(b'IDAT', zlib.compress(rows.tobytes(), level)) +
+            chunk(b'IEND', b''))
+
+
+def stack_header(frames, shape):
+    """Return the .npy header of a stack of uint8 frames, padded to a fixed size"""
+    header = "{'descr': '|u1', 'fortran_order': False, 'shape': (%d, %d, %d, %d), }" % ((frames,) + shape)
+    header = header.ljust(STACK_HEADER_SIZE - 10 - 1) + '\n'
+    return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1')
+
+
+class FrameRenderer:
+    """Render the population every day and write the frames from a background thread.
+
+    The simulation only copies the state grid onto a bounded queue. Colouring, scaling,
+    encoding and writing happen in the writer thread, so a day costs a copy of the grid
+    unless the disk falls behind by more than the queue holds. Frames are written as
+    <seed>.<day>.png files, or as one <seed>.npy stack of frames that can be memory mapped.
+    """
+
+    def __init__(self, directory, seed, scale=1, frame_format='png', queue_size=32):
+        if frame_format not in ('png', 'stack'):
+            raise ValueError("Unknown frame format: %s" % frame_format)
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.seed = seed
+        self.scale = scale
+        self.frame_format = frame_format
+        self.frames = queue.Queue(queue_size)
+        self.error = None
+        self.stack_file = None
+        self.stack_shape = None
+        self.stack_count = 0
+        self.bytes_written = 0
+        self.thread = threading.Thread(target=self.write_frames, daemon=True)
+        self.thread.start()
+
+    def submit(self, current_day, state_grid):
+        """Queue the state of a day for rendering"""
+        if self.error is not None:
+            raise self.error
+        self.frames.put((current_day, np.array(state_grid, dtype=np.int8)))
+
+    def write_frames(self):
+        """Render and write queued frames until the renderer is closed"""
+        while True:
+            frame = self.frames.get()
+            try:
+                if frame is None:
+                    return
+                if self.error is None:
+                    self.write_frame(*frame)
+            except Exception as error:
+                self.error = error
+            finally:
+                self.frames.task_done()
+
+    def write_frame(self, current_day, state_grid):
+        """Render and write the frame of one day"""
+        image = render(state_grid, self.scale)
+        if self.frame_format == 'png':
+            path = os.path.join(self.directory, str(self.seed) + '.' + str(current_day) + '.png')
+            with open(path, 'wb') as image_file:
+                self.bytes_written += image_file.write(encode_png(image))
+            return
+        if self.stack_file is None:
+            self.stack_shape = image.shape
+            self.stack_file = open(os.path.join(self.directory, str(self.seed) + '.npy'), 'wb')
+            self.bytes_written += self.stack_file.write(stack_header(0, self.stack_shape))
+        self.bytes_written += self.stack_file.write(image.tobytes())
+        self.stack_count += 1
+
+    def close(self):
+        """Write the remaining frames and stop the writer thread"""
+        self.frames.put(None)
+        self.thread.join()
+        if self.stack_file is not None:
+            self.stack_file.seek(0)
+            self.stack_file.write(stack_header(self.stack_count, self.stack_shape))
+            self.stack_file.close()
+            self.stack_file = None
+        if self.error is not None:
+            raise self.error
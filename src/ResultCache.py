@@ -0,0 +1,161 @@
+import numpy as np
+import hashlib
+import json
+import os
+import time
+import zipfile
+
+# Source files whose code determines the series of a run
+MODEL_SOURCES = ['DataHandler.py', 'DataModels.py', 'Engines.py', 'RandomStreams.py', 'Simulation.py', 'Topology.py']
+
+# Input parameters that do not change the series of a run
+OPERATIONAL_PARAMETERS = ['random seeds', 'visualization', 'ensemble size', 'tiles', 'processes', 'output',
+                          'checkpoint interval', 'state log', 'trace path', 'cache path']
+
+# Age in seconds after which a temporary file is left over from a failed write and not one in progress
+STALE_SECONDS = 3600
+
+# Hash of the model sources, computed once per process
+model_version = None
+
+
+def engine_version():
+    """Return a hash of the source of the model, which changes whenever the model code changes"""
+    global model_version
+    if model_version is None:
+        digest = hashlib.sha256()
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for name in MODEL_SOURCES:
+            with open(os.path.join(directory, name), 'rb') as source_file:
+                digest.update(name.encode('utf-8') + b'\0' + source_file.read())
+        model_version = digest.hexdigest()
+    return model_version
+
+
+def run_key(data_handler, seed, engine=None):
+    """Return the cache key of a run: a hash of its input parameters, seed and the engine version"""
+    params = data_handler.input_data_summary()
+    for name in OPERATIONAL_PARAMETERS:
+        params.pop(name, None)
+    if engine is not None:
+        params['engine'] = engine
+    if data_handler.topology == 'edge_list':
+        # The network is part of the input, not just the name of its file
+        with open(data_handler.edge_list_path, 'rb') as edge_file:
+            params['edge list'] = hashlib.sha256(edge_file.read()).hexdigest()
+    text = json.dumps({'params': params, 'seed': int(seed), 'version': engine_version()},
+                      sort_keys=True, default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """Directory of finished runs addressed by the hash of their inputs.
+
+    Every entry is an .npz file with the (days x metrics) series of a run and whether
+    it was truncated. A hit touches the file, and when the entries grow beyond
+    max_bytes the least recently used ones are removed. Entries of older model code
+    are never hit again, so they age out the same way.
+    """
+
+    def __init__(self, directory, max_bytes=2 ** 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.total_bytes = None
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key):
+        """Return the path of the entry of a key"""
+        return os.path.join(self.directory, key[:2], key + '.npz')
+
+    def get(self, key):
+        """Return the series and truncated flag of a run, or None if it is not cached. Broken entries are removed"""
+        path = self.path(key)
+        try:
+            with np.load(path) as entry:
+                values = entry['values']
+                truncated = bool(entry['truncated'])
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except (OSError, KeyError, ValueError, EOFError, zipfile.BadZipFile):
+            self.misses += 1
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        self.hits += 1
+        return values, truncated
+
+    def put(self, key, values, truncated=False):
+        """Save the series of a run and evict the least recently used entries beyond the size bound"""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Parallel workers may write the same entry, so every write goes to its own file first
+        temporary = path + '.' + str(os.getpid()) + '.tmp'
+        with open(temporary, 'wb') as entry_file:
+            np.savez(entry_file, values=np.asarray(values, dtype=np.int64), truncated=truncated)
+        # An entry that is written again replaces the old file, whose size no longer counts
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        os.replace(temporary, path)
+        if self.total_bytes is None:
+            self.total_bytes = sum(size for _, size, _ in self.entries())
+        else:
+            self.total_bytes += os.path.getsize(path) - replaced
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def entries(self, suffix='.npz'):
+        """Return the (path, size, last use) of every entry, or of every file with another suffix"""
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for folder in os.scandir(self.directory):
+            if not folder.is_dir():
+                continue
+            for entry in os.scandir(folder.path):
+                if entry.name.endswith(suffix):
+                    try:
+                        status = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((entry.path, status.st_size, status.st_mtime))
+        return entries
+
+    def remove_temporaries(self, age=STALE_SECONDS):
+        """Remove the temporary files of writes that failed at least age seconds ago"""
+        now = time.time()
+        for path, _, modified in self.entries('.tmp'):
+            if now - modified >= age:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def evict(self):
+        """Remove stale temporary files and the least recently used entries until the cache is below three quarters of its bound"""
+        self.remove_temporaries()
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        self.total_bytes = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if self.total_bytes <= self.max_bytes * 3 // 4:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.total_bytes -= size
+
+    def clear(self):
+        """Remove every entry and temporary file"""
+        for path, _, _ in self.entries() + self.entries('.tmp'):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.total_bytes = 0
@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+import json
+import os
+import struct
+
+# Every record starts with a tag, the length of its metadata and the number of days
+RECORD_HEADER = struct.Struct('<4sIQ')
+RECORD_TAG = b'RUN1'
+FILE_TAG = b'EPIDEMIC RESULTS\n\0'
+
+
+class ResultStore:
+    """Append-only binary file holding the daily series of many runs.
+
+    Each record is a header, the run metadata as JSON (probability, seed and input
+    parameters) and the (days x metrics) int64 series. Records are appended and never
+    rewritten, and the index of the records is read from the headers when the store
+    is opened for reading, so selecting runs does not parse any series.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index = None
+
+    def append(self, prob, seed, values, metrics, params=None):
+        """Append the (days x metrics) series of a run. Returns the number of bytes written"""
+        return self.extend([(prob, seed, values, metrics, params)])
+
+    def extend(self, runs):
+        """Append the series of several runs, given as (prob, seed, values, metrics, params), with one open.
+
+        Returns the number of bytes written.
+        """
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        written = 0
+        with open(self.path, 'ab') as store_file:
+            if store_file.tell() == 0:
+                store_file.write(FILE_TAG + b'\0' * (-len(FILE_TAG) % 8))
+            for prob, seed, values, metrics, params in runs:
+                values = np.ascontiguousarray(values, dtype=np.int64)
+                meta = json.dumps({'prob': float(prob), 'seed': None if seed is None else int(seed),
+                                   'metrics': list(metrics), 'params': params or {}}, default=str).encode('utf-8')
+                # Pad the metadata so that the series starts at a multiple of 8 bytes
+                meta += b' ' * (-(RECORD_HEADER.size + len(meta)) % 8)
+                store_file.write(RECORD_HEADER.pack(RECORD_TAG, len(meta), len(values)))
+                store_file.write(meta)
+                store_file.write(values.tobytes())
+                written += RECORD_HEADER.size + len(meta) + values.nbytes
+        self.index = None
+        return written
+
+    def load_index(self):
+        """Read the metadata and series offset of every record"""
+        self.index = []
+        if not os.path.exists(self.path):
+            return self.index
+        size = os.path.getsize(self.path)
+        with open(self.path, 'rb') as store_file:
+            if store_file.read(len(FILE_TAG)) != FILE_TAG:
+                raise ValueError("Not a result store: %s" % self.path)
+            offset = len(FILE_TAG) + (-len(FILE_TAG) % 8)
+            while offset + RECORD_HEADER.size <= size:
+                store_file.seek(offset)
+                tag, meta_length, days = RECORD_HEADER.unpack(store_file.read(RECORD_HEADER.size))
+                if tag != RECORD_TAG:
+                    raise ValueError("Corrupt record at byte %d of %s" % (offset, self.path))
+                meta = json.loads(store_file.read(meta_length).decode('utf-8'))
+                data_offset = offset + RECORD_HEADER.size + meta_length
+                next_offset = data_offset + days * len(meta['metrics']) * 8
+                if next_offset > size:
+                    # A record that was cut off while being written
+                    break
+                meta['offset'] = data_offset
+                meta['days'] = days
+                self.index.append(meta)
+                offset = next_offset
+        return self.index
+
+    def select(self, prob=None, seed=None):
+        """Return the index entries of the runs with the given probability and/or seed"""
+        if self.index is None:
+            self.load_index()
+        return [entry for entry in self.index
+                if (prob is None or entry['prob'] == prob) and (seed is None or entry['seed'] == seed)]
+
+    def values(self, entry):
+        """Return the series of an index entry as a read-only memory mapped (days x metrics) array"""
+        if entry['days'] == 0:
+            return np.zeros((0, len(entry['metrics'])), dtype=np.int64)
+        return np.memmap(self.path, dtype=np.int64, mode='r', offset=entry['offset'],
+                         shape=(entry['days'], len(entry['metrics'])))
+
+    def read(self, prob=None, seed=None):
+        """Return the selected runs like DataHandler.data_frames, with a DataFrame per run"""
+        return [{'prob': entry['prob'], 'seed': entry['seed'],
+                 'df': pd.DataFrame(np.array(self.values(entry)), columns=entry['metrics'])}
+                for entry in self.select(prob, seed)]
+
+    def export_csv(self, directory, prob=None, seed=None):
+        """Write the selected runs as <directory>/<probability>/<seed>.csv, like DataHandler.data_summary"""
+        for run in self.read(prob, seed):
+            path = os.path.join(directory, str(run['prob']))
+            os.makedirs(path, exist_ok=True)
+            run['df'].to_csv(os.path.join(path, str(run['seed']) + ".csv"))
@@ -1,13 +1,28 @@
-from DataModels import Person
-from DataModels import Population
+from Checkpoint import StateLogWriter
+from Checkpoint import load_checkpoint
+from Checkpoint import save_checkpoint
+from DataHandler import ACC_INFECTED
+from DataHandler import SeriesBlock
 from DataModels import State
+from Engines import EnsembleEngine
+from Engines import create_engine
+from Engines import engine_class
+from Instrumentation import Instrumentation
+from OutputWriter import flush_output
+from OutputWriter import output_writer
+from Renderer import FrameRenderer
+from ResultCache import ResultCache
+from ResultCache import run_key
+from Statistics import bootstrap_summary
+from ThresholdSearch import ThresholdSearch
+from Topology import is_moore_lattice
+from Topology import shared_topology
 import pandas as pd
-import seaborn as sns
 import numpy as np
 import os
-import matplotlib.pyplot as plt
-from scipy import stats
-from statsmodels.graphics.gofplots import qqplot
+import io
+import copy
+import multiprocessing
 
 
 class Simulation:
@@ -16,13 +31,29 @@ class Simulation:
     def __init__(self, data_handler):
         """Init the population for the simluation"""
         self.data_handler = data_handler
-        self.population_holder = Population(data_handler)
-        self.population_holder.generate_neighbours()
+        self.instrumentation = Instrumentation()
+        self.cache = None
+        self.engine = create_engine(data_handler)
+        self.engine.reset()
+
+    @property
+    def population_holder(self):
+        """The population of the engine, if the engine keeps one"""
+        return self.engine.population_holder
 
     def reset(self):
-        """Resets the simulation class with the current data handler values"""
-        self.population_holder = Population(self.data_handler)
-        self.population_holder.generate_neighbours()
+        """Resets the simulation class with the current data handler values.
+
+        The engine is kept if the data handler still selects it, so it can reuse its arrays and network.
+        """
+        if type(self.engine) is not engine_class(self.data_handler):
+            self.engine.close()
+            self.engine = create_engine(self.data_handler)
+        self.engine.reset()
+
+    def close(self):
+        """Release the workers and shared memory of the engine, if it holds any"""
+        self.engine.close()
 
     def set_random_seed(self, random_seed):
         """Set the random seed for the random generator. This is needed for reproducability"""
@@ -30,71 +61,69 @@ class Simulation:
 
     def compile_results(self):
         """Compile simple statistical information from the simulation"""
-        infected = []
-        dead = []
+        aggregate = self.data_handler.aggregate(self.data_handler.infection_probability)
+        infected = aggregate.infected
+        dead = aggregate.dead
         data = {
-            'avg_infected': 0,
-            'med_infected': 0,
-            'std_infected': 0,
-            'average_median_difference_infected': 0,
-            'avg_dead': 0,
-            'med_dead': 0,
-            'std_dead': 0,
-            'average_median_difference_dead': 0
+            'avg_infected': infected.average(),
+            'med_infected': infected.median(),
+            'std_infected': infected.std(),
+            'average_median_difference_infected': np.abs(infected.average() - infected.median()),
+            'avg_dead': dead.average(),
+            'med_dead': dead.median(),
+            'std_dead': dead.std(),
+            'average_median_difference_dead': np.abs(dead.average() - dead.median()),
+            'epidemic_fraction': aggregate.epidemic_fraction(),
+            # The final counts of truncated runs are lower bounds
+            'truncated_runs': aggregate.truncated,
+            'histogram_infected': infected.histogram_summary(),
+            'histogram_dead': dead.histogram_summary()
         }
-        for obj in self.data_handler.data_frames:
-            if obj['prob'] == self.data_handler.infection_probability:
-                infected.append(np.max(obj['df']['infected_accumulated']))
-                dead.append(np.max(obj['df']['dead_accumulated']))
-        data['avg_infected'] = np.mean(infected)
-        data['med_infected'] = np.median(infected)
-        data['avg_dead'] = np.mean(dead)
-        data['med_dead'] = np.median(dead)
-        data['std_infected'] = np.std(infected)
-        data['std_dead'] = np.std(dead)
-        data['average_median_difference_infected'] = np.abs(
-            np.mean(infected) - np.median(infected))
-        data['average_median_difference_dead'] = np.abs(
-            np.mean(dead) - np.median(dead))
+        intervals = self.summarize_results({aggregate.prob: aggregate}).iloc[0]
+        data['ci_infected'] = (intervals['infected_mean_low'], intervals['infected_mean_high'])
+        data['ci_dead'] = (intervals['dead_mean_low'], intervals['dead_mean_high'])
+        data['outbreak_probability'] = intervals['outbreak_probability']
+        data['ci_outbreak_probability'] = (intervals['outbreak_probability_low'],
+                                           intervals['outbreak_probability_high'])
         return data
 
-    def append_results(self, seed, data_frame):
-        """Append the result frame for a simulation with a specific seed and infection probability"""
-        self.data_handler.data_frames.append(
-            {'prob': self.data_handler.infection_probability, 'seed': seed, 'df': data_frame})
+    def summarize_results(self, aggregates=None):
+        """Bootstrap the results of every infection probability, or of the given aggregates, into a frame with one row per probability"""
+        if aggregates is None:
+            aggregates = self.data_handler.aggregates
+        return bootstrap_summary(aggregates, self.data_handler.epidemic_size(),
+                                 self.data_handler.bootstrap_resamples, self.data_handler.confidence_level)
+
+    def append_results(self, seed, data_frame, prob=None, truncated=False):
+        """Add the result frame for a simulation with a specific seed and infection probability to the aggregates.
+
+        The frame itself is only kept in data_frames if the data handler retains frames.
+        Returns the result of the simulation, flagged if it was an epidemic and if it was
+        stopped early by the classification mode.
+        """
+        if prob is None:
+            prob = self.data_handler.infection_probability
+        final = data_frame.iloc[-1] if len(data_frame) > 0 else data_frame.sum()
+        epidemic = bool(final['infected_accumulated'] > self.data_handler.epidemic_size())
+        result = {'prob': prob, 'seed': seed, 'df': data_frame, 'epidemic': epidemic, 'truncated': truncated}
+        self.data_handler.aggregate(prob).add(
+            final['infected_accumulated'], final['dead_accumulated'], epidemic, truncated)
+        if self.data_handler.retain_frames:
+            self.data_handler.data_frames.append(result)
+        return result
 
     def visualize_results(self, seed):
         """Visualize the status of the population"""
-        g1_x = []
-        g1_y = []
-        g2_x = []
-        g2_y = []
-        g3_x = []
-        g3_y = []
-        g4_x = []
-        g4_y = []
-        infected = 0
-        healthy = 0
-        immune = 0
-        dead = 0
-        for person in self.population_holder.population.flatten():
-
-            if person.state == State.infected:
-                g1_x.append(person.coordinates['x'])
-                g1_y.append(person.coordinates['y'])
-                infected += 1
-            if person.state == State.susceptible:
-                g2_x.append(person.coordinates['x'])
-                g2_y.append(person.coordinates['y'])
-                healthy += 1
-            if person.state == State.immune:
-                g3_x.append(person.coordinates['x'])
-                g3_y.append(person.coordinates['y'])
-                immune += 1
-            if person.state == State.dead:
-                g4_x.append(person.coordinates['x'])
-                g4_y.append(person.coordinates['y'])
-                dead += 1
+        import matplotlib.pyplot as plt
+        state_grid = self.engine.state_grid()
+        g1_x, g1_y = np.nonzero(state_grid == State.infected.value)
+        g2_x, g2_y = np.nonzero(state_grid == State.susceptible.value)
+        g3_x, g3_y = np.nonzero(state_grid == State.immune.value)
+        g4_x, g4_y = np.nonzero(state_grid == State.dead.value)
+        infected = len(g1_x)
+        healthy = len(g2_x)
+        immune = len(g3_x)
+        dead = len(g4_x)
         g1 = (g1_x, g1_y)
         g2 = (g2_x, g2_y)
         g3 = (g3_x, g3_y)
@@ -102,9 +131,9 @@ class Simulation:
 
         dot_scale_value = 100
 
-        if 30 <= self.population_holder.population_size:
+        if 30 <= self.data_handler.population_size:
             dot_scale_value = 10
-        elif 10 < self.population_holder.population_size < 30:
+        elif 10 < self.data_handler.population_size < 30:
             dot_scale_value = 30
         else:
             dot_scale_value = 80
@@ -151,179 +180,387 @@ class Simulation:
 
 
         # Save the image of the current day in a folder specific to the infection probability.
-        path = "../res/" + str(self.data_handler.infection_probability)
-        if os.path.isdir(path):
-            inner = path + "/img"
-            if os.path.isdir(inner):
-                plt.savefig(inner + '/' + str(seed) + '.' +
-                            str(self.data_handler.current_day) + '.png')
-            else:
-                try:
-                    os.mkdir(inner)
-                    plt.savefig(inner + '/' + str(seed) + '.' +
-                                str(self.data_handler.current_day) + '.png')
-                except OSError:
-                    print("Creation of the directory %s failed" % path)
-
-        else:
-            try:
-                os.mkdir(path)
-                inner = path + "/img"
-                if os.path.isdir(inner):
-                    plt.savefig(inner + '/' + str(seed) + '.' +
-                                str(self.data_handler.current_day) + '.png')
-                else:
-                    try:
-                        os.mkdir(inner)
-                        plt.savefig(inner + '/' + str(seed) + '.' +
-                                    str(self.data_handler.current_day) + '.png')
-                    except OSError:
-                        print("Creation of the directory %s failed" % path)
-            except OSError:
-                print("Creation of the directory %s failed" % path)
-            else:
-                print("Successfully created the directory %s " % path)
-        plt.close()
+        # The figure is rendered here, as matplotlib is not thread safe, and written in the background.
+        image = io.BytesIO()
+        fig.savefig(image, format='png')
+        plt.close(fig)
+        path = "../res/" + str(self.data_handler.infection_probability) + "/img"
+        output_writer().write_bytes(path + '/' + str(seed) + '.' + str(self.data_handler.current_day) + '.png',
+                                    image.getvalue())
+
+    def create_renderer(self, seed):
+        """Create the raster frame renderer for a run"""
+        scale = self.data_handler.frame_scale
+        if scale <= 0:
+            scale = max(1, 512 // self.data_handler.population_size)
+        path = "../res/" + str(self.data_handler.infection_probability) + "/img"
+        return FrameRenderer(path, seed, scale, self.data_handler.frame_format)
+
+    def checkpoint_path(self, seed):
+        """Return the path of the checkpoint of a run"""
+        return "../res/" + str(self.data_handler.infection_probability) + "/checkpoints/" + str(seed) + ".npz"
+
+    def state_log_path(self, seed):
+        """Return the path of the state log of a run"""
+        return "../res/" + str(self.data_handler.infection_probability) + "/" + str(seed) + ".statelog"
+
+    def result_cache(self):
+        """Return the result cache of the data handler, or None if caching is off"""
+        if self.data_handler.cache_path is None:
+            return None
+        if self.cache is None or self.cache.directory != self.data_handler.cache_path:
+            self.cache = ResultCache(self.data_handler.cache_path, self.data_handler.cache_size)
+        return self.cache
 
     def analyze(self):
         """Analyze and save the current status of the population numerically"""
-        susceptible_count = 0
-        infected_count = 0
-        sick_count = 0
-        recovered_count = 0
-        dead_count = 0
-        for person in self.population_holder.population.flatten():
-            if person.state == State.susceptible:
-                susceptible_count += 1
-            if person.state == State.infected and person.day_of_infection < self.data_handler.current_day:
-                sick_count += 1
-            if person.state == State.infected and person.day_of_infection == self.data_handler.current_day:
-                infected_count += 1
-            if person.state == State.immune and person.day_of_immunity == self.data_handler.current_day:
-                recovered_count += 1
-            if person.state == State.dead and person.day_of_death == self.data_handler.current_day:
-                dead_count += 1
-        self.data_handler.susceptible_per_day.append(susceptible_count)
-        self.data_handler.infected_per_day.append(infected_count)
-        self.data_handler.sick_per_day.append(sick_count)
-        self.data_handler.recovered_per_day.append(recovered_count)
-        self.data_handler.dead_per_day.append(dead_count)
-
-        if len(self.data_handler.acc_dead_per_day) < 1:
-            self.data_handler.acc_dead_per_day.append(dead_count)
-        else:
-            self.data_handler.acc_dead_per_day.append(
-                dead_count + self.data_handler.acc_dead_per_day[self.data_handler.current_day - 1])
-
-        if len(self.data_handler.acc_infected_per_day) < 1:
-            self.data_handler.acc_infected_per_day.append(infected_count)
-        else:
-            self.data_handler.acc_infected_per_day.append(
-                infected_count + self.data_handler.acc_infected_per_day[self.data_handler.current_day - 1])
+        self.record_day(*self.engine.census())
 
-        if len(self.data_handler.acc_recovered_per_day) < 1:
-            self.data_handler.acc_recovered_per_day.append(recovered_count)
-        else:
-            self.data_handler.acc_recovered_per_day.append(
-                recovered_count + self.data_handler.acc_recovered_per_day[self.data_handler.current_day - 1])
+    def record_day(self, susceptible_count, infected_count, sick_count, recovered_count, dead_count):
+        """Save the counts of the current day and the accumulated counts"""
+        self.data_handler.series.record(
+            (susceptible_count, infected_count, sick_count, recovered_count, dead_count))
 
-    def run_full_simulation(self):
+    def run_full_simulation(self, plot=True):
         """An automation function to run simulations with a collection of infection probabilities to find the threshold for the infection probability turning into an epidemic."""
+        if self.data_handler.processes > 1:
+            self.run_parallel_sweep()
+            for prob in self.data_handler.infection_probabilities:
+                self.data_handler.infection_probability = prob
+                print(self.compile_results())
+            if plot:
+                self.plot_results()
+            return
+
         for prob in self.data_handler.infection_probabilities:
             self.data_handler.infection_probability = prob
-            for seed in self.data_handler.random_seeds:
-                self.data_handler.seed = seed
-                self.run_simluation()
+            if self.data_handler.ensemble_size > 0:
+                seeds = self.data_handler.random_seeds
+                for start in range(0, len(seeds), self.data_handler.ensemble_size):
+                    self.run_ensemble(seeds[start:start + self.data_handler.ensemble_size])
+            else:
+                for seed in self.data_handler.random_seeds:
+                    self.data_handler.seed = seed
+                    self.run_simluation()
             print(self.compile_results())
+        # The results are on disk when the sweep returns
+        flush_output()
+
+        if plot:
+            self.plot_results()
+
+    def outbreak_decided(self):
+        """Return True if the current run already infected more than epidemic_size people"""
+        series = self.data_handler.series
+        return len(series) > 0 and series.view()[-1, ACC_INFECTED] > self.data_handler.epidemic_size()
+
+    def find_threshold(self, tolerance=0.001):
+        """An automation function to search for the infection probability threshold of an epidemic, spending runs only where the outcome is uncertain."""
+        search = ThresholdSearch(self, tolerance=tolerance)
+        data = search.run()
+        flush_output()
+        print("Threshold:", data['threshold'], "interval:", data['interval'],
+              "confidence:", data['confidence'], "bracket:", data['bracket'], "runs:", data['runs'])
+        return data
 
-        self.plot_results()
+    def run_parallel_sweep(self):
+        """Run every (probability, seed) pair in a pool of worker processes.
+
+        Each worker simulates with its own copy of the data handler and resets its engine
+        between jobs like a serial run does, so the results are the same as a serial run.
+        The frames are appended in the order of the serial loop.
+        """
+        if self.data_handler.engine == 'tiled':
+            raise ValueError("The tiled engine runs its own worker processes, set processes to 1 to use it")
+        template = copy.deepcopy(self.data_handler)
+        template.data_frames = []
+        template.aggregates = {}
+        if template.output == 'store':
+            # The store is appended by this process only, after the workers are done
+            template.output = 'none'
+        jobs = []
+        for prob in self.data_handler.infection_probabilities:
+            # Create the output directories the runs write to before the workers race to create them
+            if self.data_handler.output == 'csv' or self.data_handler.visualize != 0:
+                output_writer().makedirs("../res/" + str(prob))
+            if self.data_handler.visualize == 1:
+                output_writer().makedirs("../res/" + str(prob) + "/img")
+            for seed in self.data_handler.random_seeds:
+                jobs.append((prob, seed))
+        # The workers are forked, so nothing should be half written by this process's writer thread
+        flush_output()
+
+        if self.data_handler.engine == 'network' or not is_moore_lattice(self.data_handler):
+            # Workers forked after the network is built share it instead of building their own
+            shared_topology(self.data_handler)
+        with multiprocessing.Pool(self.data_handler.processes, initializer=init_sweep_worker,
+                                  initargs=(template,)) as pool:
+            # Every result is aggregated as it arrives, so only the retained frames stay in memory
+            for result in pool.imap(run_sweep_job, jobs, chunksize=1):
+                self.append_results(result['seed'], result['df'], result['prob'], result['truncated'])
+                if self.data_handler.output == 'store':
+                    self.data_handler.infection_probability = result['prob']
+                    self.data_handler.store_results(result['seed'], result['df'].values)
+        flush_output()
 
     def plot_results(self):
         """Function to plot the Mean and Median of each infection probability when using multiple seeds."""
-        columns = ['Population Infected', 'Infection Probability']
-        df_total_data = pd.DataFrame(columns=columns)
-        list_of_frames = []
-        for frame in self.data_handler.data_frames:
-            df = {'Population Infected': np.max(
-                frame['df']['infected_accumulated']), 'Infection Probability': frame['prob']}
-            list_of_frames.append(df)
-
-        df_total_data = df_total_data.append(list_of_frames)
-
-        # Plot the mean
-        ax = sns.pointplot(scale=0.5, data=df_total_data, x="Infection Probability",
-                           y="Population Infected", capsize=.2, errwidth=0.6, estimator=np.mean)
-        plt.axhline(np.square(self.data_handler.population_size) / 2,
-                    color="k", linestyle="--", label='Epidemic Outbreak Threshold')
-        plt.legend()
-        title = "Mean Total number of people infected per infection probability"
-        plt.title(title)
-        plt.show(ax)
-
-        # Plot the median
-        ax = sns.pointplot(scale=0.5, data=df_total_data, x="Infection Probability",
-                           y="Population Infected", capsize=.2, errwidth=0.6, estimator=np.median)
-        plt.axhline(np.square(self.data_handler.population_size) / 2,
-                    color="k", linestyle="--", label='Epidemic Outbreak Threshold')
-        plt.legend()
-        title = "Median Total number of people infected per infection probability"
-        plt.title(title)
-        plt.show(ax)
+        import matplotlib.pyplot as plt
+        if any(aggregate.truncated > 0 for aggregate in self.data_handler.aggregates.values()):
+            # Truncated runs only tell if they were epidemics, their final counts are lower bounds
+            self.plot_epidemic_fractions()
+            return
+
+        summary = self.summarize_results()
+        for statistic, name in (('mean', 'Mean'), ('median', 'Median')):
+            estimate = summary['infected_' + statistic]
+            ax = plt.gca()
+            ax.errorbar(summary['prob'], estimate, fmt='o-', markersize=4, capsize=4, elinewidth=0.6,
+                        yerr=[estimate - summary['infected_' + statistic + '_low'],
+                              summary['infected_' + statistic + '_high'] - estimate])
+            plt.axhline(self.data_handler.epidemic_size(),
+                        color="k", linestyle="--", label='Epidemic Outbreak Threshold')
+            plt.legend()
+            plt.xlabel('Infection Probability')
+            plt.ylabel('Population Infected')
+            title = name + " Total number of people infected per infection probability"
+            plt.title(title)
+            plt.show()
 
         self.plot_distribution()
 
+    def plot_epidemic_fractions(self):
+        """Function to plot the fraction of runs that turned into an epidemic for each infection probability."""
+        import matplotlib.pyplot as plt
+        summary = self.summarize_results()
+        fraction = summary['outbreak_probability']
+        ax = plt.gca()
+        ax.errorbar(summary['prob'], fraction, fmt='o-', markersize=4, capsize=4, elinewidth=0.6,
+                    yerr=[fraction - summary['outbreak_probability_low'],
+                          summary['outbreak_probability_high'] - fraction])
+        plt.axhline(0.5, color="k", linestyle="--", label='Epidemic Outbreak Threshold')
+        plt.legend()
+        plt.xlabel('Infection Probability')
+        plt.ylabel('Fraction of runs with an epidemic')
+        plt.title("Fraction of epidemics per infection probability")
+        plt.show()
+
     def plot_distribution(self):
         """Function to plot and visualize central tendencies and normality of the simulation results."""
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+        from statsmodels.graphics.gofplots import qqplot
+        aggregates = [aggregate for prob, aggregate in sorted(self.data_handler.aggregates.items())]
+        if any(aggregate.infected.values is None for aggregate in aggregates):
+            # Without the values of the runs only the histograms are known
+            histogram = sum(aggregate.infected.histogram for aggregate in aggregates)
+            edges = aggregates[0].infected.bin_edges
+            plt.bar(edges[:-1], histogram, width=np.diff(edges), align='edge')
+            plt.title("Distribution of the number of infected for different seeds")
+            plt.ylabel('Runs')
+            plt.show()
+            return
+
         x = []
-        for frame in self.data_handler.data_frames:
-            x.append(np.max(frame['df']['infected_accumulated']))
+        for aggregate in aggregates:
+            x.extend(aggregate.infected.values)
         serie = pd.Series(x, name="Number of infected for different seeds")
-        ax = sns.distplot(serie, rug=True, hist=False)
+        sns.distplot(serie, rug=True, hist=False)
         plt.title("Central tendencies of distribution")
         plt.ylabel('Kernel Density Estimation')
-        plt.show(ax)
+        plt.show()
 
         data = np.array(x)
-        ax = qqplot(data, line='s')
-        plt.show(ax)
-
-    def run_simluation(self):
-        """The central simulation function."""
-        seed = self.data_handler.seed
-        print("Simulating with seed: ", seed)
-        self.set_random_seed(seed)
-        self.data_handler.reset()
-        self.reset()
+        qqplot(data, line='s')
+        plt.show()
+
+    def run_ensemble(self, seeds):
+        """Simulate a batch of seeds at once with the ensemble engine and save the results of each seed in seed order"""
+        data_handler = self.data_handler
+        settings = (('visualize', data_handler.visualize), ('state_log', data_handler.state_log),
+                    ('checkpoint_interval', data_handler.checkpoint_interval), ('trace_path', data_handler.trace_path))
+        unsupported = [name for name, value in settings if value]
+        if unsupported:
+            raise ValueError("The ensemble engine does not support %s, set ensemble_size to 0 to use them" %
+                             ", ".join(unsupported))
+        seeds = list(seeds)
+        # Series and truncated flag of every seed, by its index in seeds
+        results = [None] * len(seeds)
+        cache = self.result_cache()
+        if cache is not None:
+            # Replicates reproduce the vectorized engine, so they share its cache entries
+            keys = [run_key(self.data_handler, seed, engine='vectorized') for seed in seeds]
+            for number in range(len(seeds)):
+                results[number] = cache.get(keys[number])
+        missing = [number for number in range(len(seeds)) if results[number] is None]
+
+        if len(missing) > 0:
+            simulated = [seeds[number] for number in missing]
+            print("Simulating ensemble with seeds: ", simulated[0], "to", simulated[-1])
+            self.data_handler.reset()
+            if self.data_handler.ensemble_series is None:
+                self.data_handler.ensemble_series = SeriesBlock(len(simulated))
+            else:
+                self.data_handler.ensemble_series.clear(len(simulated))
+            ensemble = EnsembleEngine(self.data_handler, simulated)
+            ensemble.reset()
+
+            while ensemble.infected_present():
+                ensemble.infect()
+                ensemble.update()
+                ensemble.analyze()
+                self.data_handler.current_day += 1
+
+            for replicate, number in enumerate(missing):
+                results[number] = (self.data_handler.ensemble_series.view(replicate),
+                                   bool(ensemble.truncated[replicate]))
+                if cache is not None:
+                    cache.put(keys[number], *results[number])
+
+        for seed, (values, truncated) in zip(seeds, results):
+            self.data_handler.seed = seed
+            self.append_results(seed, self.data_handler.data_summary(seed, values), truncated=truncated)
+
+    def run_simluation(self, resume_from=None):
+        """The central simulation function. A run can be resumed from a checkpoint file."""
+        # Runs that write frames or logs are simulated even when they are cached
+        cache = None
+        if (resume_from is None and self.data_handler.seed is not None and self.data_handler.visualize == 0 and
+                not self.data_handler.state_log):
+            cache = self.result_cache()
+        if cache is not None:
+            key = run_key(self.data_handler, self.data_handler.seed)
+            cached = cache.get(key)
+            if cached is not None:
+                seed = self.data_handler.seed
+                print("Cached result for seed: ", seed)
+                self.data_handler.reset()
+                self.data_handler.series.load(cached[0])
+                return self.append_results(seed, self.data_handler.data_summary(seed), truncated=cached[1])
+
+        if resume_from is None:
+            seed = self.data_handler.seed
+            print("Simulating with seed: ", seed)
+            self.set_random_seed(seed)
+            self.data_handler.reset()
+            self.reset()
+        else:
+            load_checkpoint(self, resume_from)
+            seed = self.data_handler.seed
+            print("Resuming seed", seed, "at day", self.data_handler.current_day)
+
+        instrumentation = self.instrumentation
+        instrumentation.trace_path = self.data_handler.trace_path
+        instrumentation.start_run(seed, self.data_handler.infection_probability)
+
+        checkpoint_interval = self.data_handler.checkpoint_interval
+
+        renderer = None
+        state_log = None
+        truncated = False
+        try:
+            if self.data_handler.visualize == 2:
+                renderer = self.create_renderer(seed)
+            if self.data_handler.state_log:
+                state_log = StateLogWriter(self.state_log_path(seed), self.engine.state_grid(),
+                                           self.data_handler.current_day)
+
+            # Run until entire population is either dead or immune
+            while self.engine.infected_present():
+                instrumentation.start_day(self.data_handler.current_day)
+
+                # Examine and infect
+                with instrumentation.phase('infect'):
+                    self.engine.infect()
+                for name, value in self.engine.counters.items():
+                    instrumentation.count(name, value)
+
+                # Update the status of each person after the entire population has been examined
+                with instrumentation.phase('update'):
+                    self.engine.update()
+
+                # Analyze the status of the population and save data for current day
+                with instrumentation.phase('analyze'):
+                    self.analyze()
+
+                # Visualize the status of the population as a grid
+                with instrumentation.phase('visualize'):
+                    if(self.data_handler.visualize == 1):
+                        self.visualize_results(seed)
+                    elif renderer is not None:
+                        renderer.submit(self.data_handler.current_day, self.engine.state_grid())
+                if state_log is not None:
+                    with instrumentation.phase('state log'):
+                        instrumentation.count('bytes written', state_log.record(
+                            self.data_handler.current_day, self.engine.state_grid()))
+                instrumentation.end_day()
+                self.data_handler.current_day += 1
+
+                if checkpoint_interval > 0 and self.data_handler.current_day % checkpoint_interval == 0:
+                    with instrumentation.phase('checkpoint'):
+                        instrumentation.count('bytes written', save_checkpoint(self, self.checkpoint_path(seed)))
+
+                # In classification mode the run is over once it is known to be an epidemic
+                if self.data_handler.classify_only and self.outbreak_decided():
+                    truncated = True
+                    break
+        except BaseException:
+            # The engine keeps its workers and shared memory for the next run only if this one finishes
+            self.engine.close()
+            instrumentation.close()
+            raise
+        finally:
+            # The writer thread and stack file of the frames and the state log are closed even if the run fails
+            try:
+                if renderer is not None:
+                    with instrumentation.phase('visualize'):
+                        renderer.close()
+                    instrumentation.count('bytes written', renderer.bytes_written)
+            finally:
+                if state_log is not None:
+                    state_log.close()
+        # The checkpoint of a finished run is of no use anymore
+        if checkpoint_interval > 0 and os.path.exists(self.checkpoint_path(seed)):
+            os.remove(self.checkpoint_path(seed))
+
+        if cache is not None:
+            cache.put(key, self.data_handler.series.view(), truncated)
 
-        # Run until entire population is either dead or immune
-        while self.population_holder.infected_present():
+        # Summarize the data for the simulation with the current seed and save it.
+        with instrumentation.phase('summary'):
+            result = self.append_results(seed, self.data_handler.data_summary(seed), truncated=truncated)
+            # Bytes the output writer finished since the last run, as it writes in the background
+            instrumentation.count('bytes written', output_writer().take_bytes_written())
+        instrumentation.end_run()
 
-            # Examine and infect
-            for person in self.population_holder.population.flatten():
+        # return the simulation data.
+        return result
 
-                # The incubation time for an infected individual to start being contagious is 1 day.
-                # An infected individual cannot infect neighbours until after 1 day of getting infected.
-                if person.state == State.infected and person.day_of_infection < self.data_handler.current_day:
 
-                    for neighbour in person.get_neighbours().flatten():
-                        neighbour.infect(self.data_handler.infection_probability,
-                                         self.data_handler.current_day, self.data_handler.interval)
+# Data handler template of a sweep worker process, set by init_sweep_worker
+sweep_simulation = None
 
-            # Update the status of each person after the entire population has been examined
-            for person in self.population_holder.population.flatten():
-                person.update(self.data_handler.current_day,
-                              self.data_handler.mortality_probability)
 
-            # Analyze the status of the population and save data for current day
-            self.analyze()
+def init_sweep_worker(data_handler):
+    """Create the simulation of the worker process from the data handler template of the sweep.
 
-            # Visualize the status of the population as a grid
-            if(self.data_handler.visualize == 1):
-                self.visualize_results(seed)
-            self.data_handler.current_day += 1
+    The simulation is kept for all jobs of the worker, so its engine reuses the population
+    and network like a serial sweep does.
+    """
+    global sweep_simulation
+    sweep_simulation = Simulation(data_handler)
 
-        # Summarize the data for the simulation with the current seed and save it.
-        self.append_results(seed, self.data_handler.data_summary(seed))
 
-        # return the simulation data.
-        return(self.data_handler.data_frames[0])
+def run_sweep_job(job):
+    """Simulate one (probability, seed) pair with the worker's simulation"""
+    prob, seed = job
+    data_handler = sweep_simulation.data_handler
+    data_handler.infection_probability = prob
+    data_handler.seed = seed
+    # The results are collected by the parent process, so the worker keeps none
+    data_handler.data_frames = []
+    data_handler.aggregates = {}
+    result = sweep_simulation.run_simluation()
+    # Pool workers exit without running atexit, so the results are written before the job returns
+    flush_output()
+    return result
@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+
+# Statistics the bootstrap computes
+STATISTICS = ('mean', 'median')
+
+
+def bootstrap_intervals(samples, resamples=2000, confidence=0.95, seed=0, chunk_size=2 ** 22):
+    """Percentile bootstrap intervals of the mean and median of every sample at once.
+
+    Samples of the same size are stacked and share their resample index matrices,
+    which are drawn in bulk, chunk_size indices at a time. The resample means are the
+    product of the values with the counts of every index, and as the values are sorted,
+    the resample medians are the values at the middle order statistics of the indices.
+    Returns {statistic: (estimates, lower, upper)} with one entry per sample. Empty
+    samples give NaN.
+    """
+    results = {statistic: tuple(np.full(len(samples), np.nan) for _ in range(3)) for statistic in STATISTICS}
+    generator = np.random.Generator(np.random.PCG64(seed))
+    tail = 50.0 * (1.0 - confidence)
+
+    by_size = {}
+    for number, sample in enumerate(samples):
+        by_size.setdefault(len(sample), []).append(number)
+    for size, members in sorted(by_size.items()):
+        if size == 0:
+            continue
+        values = np.sort(np.array([np.asarray(samples[number], dtype=float) for number in members]), axis=1)
+        replicates = {statistic: np.empty((len(members), resamples)) for statistic in STATISTICS}
+        middle = [(size - 1) // 2, size // 2]
+        step = max(1, chunk_size // size)
+        for start in range(0, resamples, step):
+            count = min(step, resamples - start)
+            indices = generator.integers(0, size, (count, size))
+            counts = np.bincount((indices + size * np.arange(count)[:, np.newaxis]).reshape(-1),
+                                 minlength=count * size).reshape(count, size)
+            replicates['mean'][:, start:start + count] = values @ counts.T / size
+            order = np.partition(indices, middle, axis=1)[:, middle]
+            replicates['median'][:, start:start + count] = (values[:, order[:, 0]] + values[:, order[:, 1]]) / 2
+
+        estimates = {'mean': values.mean(axis=1), 'median': np.median(values, axis=1)}
+        for statistic in STATISTICS:
+            result = results[statistic]
+            result[0][members] = estimates[statistic]
+            result[1][members], result[2][members] = np.percentile(
+                replicates[statistic], [tail, 100.0 - tail], axis=1)
+    return results
+
+
+def bootstrap_summary(aggregates, epidemic_size, resamples=2000, confidence=0.95, seed=0):
+    """Bootstrap the final sizes, deaths and outbreak probability of the runs of every infection probability.
+
+    Returns a frame with one row per probability: the number of runs, the mean and
+    median of the infected and dead with their intervals, and the fraction of runs
+    with more than epidemic_size infected with its interval. Aggregates that do not
+    keep their values give their streaming estimates without intervals.
+    """
+    probabilities = sorted(aggregates)
+    infected = [aggregate_values(aggregates[prob].infected) for prob in probabilities]
+    dead = [aggregate_values(aggregates[prob].dead) for prob in probabilities]
+    outbreaks = [(values > epidemic_size).astype(float) for values in infected]
+
+    # One bootstrap for all samples, so samples of the same size share the resamples
+    results = bootstrap_intervals(infected + dead + outbreaks, resamples, confidence, seed)
+    count = len(probabilities)
+    data = {'prob': probabilities, 'runs': [aggregates[prob].infected.count for prob in probabilities]}
+    for offset, name in enumerate(('infected', 'dead')):
+        for statistic in STATISTICS:
+            columns = [name + '_' + statistic, name + '_' + statistic + '_low', name + '_' + statistic + '_high']
+            for column, values in zip(columns, results[statistic]):
+                data[column] = values[offset * count:(offset + 1) * count]
+    for column, values in zip(['outbreak_probability', 'outbreak_probability_low', 'outbreak_probability_high'],
+                              results['mean']):
+        data[column] = values[2 * count:]
+    summary = pd.DataFrame(data)
+
+    for row, prob in enumerate(probabilities):
+        aggregate = aggregates[prob]
+        if aggregate.infected.values is not None:
+            continue
+        for name, stats in (('infected', aggregate.infected), ('dead', aggregate.dead)):
+            summary.loc[row, name + '_mean'] = stats.average()
+            summary.loc[row, name + '_median'] = stats.median()
+        summary.loc[row, 'outbreak_probability'] = aggregate.epidemic_fraction()
+    return summary
+
+
+def aggregate_values(stats):
+    """Return the values of a StreamingStats, or no values if it does not keep them"""
+    return np.asarray(stats.values if stats.values is not None else [], dtype=float)
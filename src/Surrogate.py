@@ -0,0 +1,288 @@
+from DataHandler import ACC_DEAD
+from DataHandler import ACC_INFECTED
+from DataHandler import ACC_RECOVERED
+from DataHandler import DEAD
+from DataHandler import INFECTED
+from DataHandler import METRICS
+from DataHandler import RECOVERED
+from DataHandler import SICK
+from DataHandler import SUSCEPTIBLE
+from DataHandler import DataHandler
+from DataModels import initial_cells
+from Topology import shared_topology
+import numpy as np
+import pandas as pd
+import argparse
+import copy
+import itertools
+import time
+
+CLOSURES = ['pair', 'mean_field']
+
+
+class PairApproximation:
+    """Deterministic approximation of the expected daily series of the lattice model.
+
+    Every cell has k neighbours, k = 8 on the radius 1 lattice. Besides the expected
+    number of people in every state, the pair approximation keeps the expected number
+    of neighbours in every state of a susceptible person, and assumes the neighbours of
+    a neighbour are like those of any susceptible person. The mean field closure
+    assumes the neighbours are like the whole population instead.
+
+    The days follow the engines: on day 0 the initial people get infected, from day 1
+    on everybody infected before the day is contagious, and the update of a day lets
+    people recover once their sick days, uniform in the interval, are over, or die with
+    the mortality probability. Infected people are kept per number of days left, slot 0
+    holding those with 0 sick days, who never recover.
+
+    Every parameter can be an array, one entry per parameter point, and all points are
+    integrated at once. A point ends when less than tolerance people are infected.
+
+    Above the epidemic threshold the final sizes and deaths are close to the mean of
+    lattice runs, but the epidemic ends sooner, as a single seed spreads over the
+    lattice as a front instead of exponentially. The threshold of the approximation is
+    lower than that of the lattice, which is the bond percolation threshold of the 8
+    neighbour lattice, so points close to it need lattice runs.
+    """
+
+    def __init__(self, data_handler, infection_probabilities=None, mortality_probabilities=None,
+                 intervals=None, closure='pair', tolerance=0.5):
+        if data_handler.topology != 'lattice':
+            raise ValueError("The surrogate only models the lattice topology")
+        if closure not in CLOSURES:
+            raise ValueError("Unknown closure: %s" % closure)
+        self.data_handler = data_handler
+        self.closure = closure
+        self.tolerance = tolerance
+        if infection_probabilities is None:
+            infection_probabilities = [data_handler.infection_probability]
+        if mortality_probabilities is None:
+            mortality_probabilities = [data_handler.mortality_probability]
+        if intervals is None:
+            intervals = [data_handler.interval]
+        infection, mortality, interval = np.broadcast_arrays(
+            np.asarray(infection_probabilities, dtype=float), np.asarray(mortality_probabilities, dtype=float),
+            np.arange(len(intervals)) if len(intervals) > 1 else np.zeros(1, dtype=int))
+        self.infection_probability = infection.copy()
+        self.mortality_probability = mortality.copy()
+        self.intervals = [intervals[number] for number in interval]
+        self.neighbours = (2 * data_handler.topology_radius + 1) ** 2 - 1
+        self.series = None
+        self.lengths = None
+
+    @property
+    def point_count(self):
+        return len(self.infection_probability)
+
+    def sick_day_chances(self):
+        """Return the chance of every number of sick days per point, slot d for d days"""
+        longest = max(interval['maxDays'] for interval in self.intervals)
+        chances = np.zeros((self.point_count, max(longest, 1) + 1))
+        for point, interval in enumerate(self.intervals):
+            chances[point, interval['minDays']:interval['maxDays'] + 1] = 1.0
+        return chances / chances.sum(axis=1, keepdims=True)
+
+    def initial_neighbours(self, susceptible):
+        """Return the mean number of initially infected neighbours of a susceptible person"""
+        data_handler = self.data_handler
+        infected = np.zeros(data_handler.population_size * data_handler.population_size)
+        infected[initial_cells(data_handler)] = 1.0
+        if susceptible <= 0:
+            return 0.0
+        pairs = shared_topology(data_handler).matrix() @ infected
+        return float(pairs[infected == 0].sum()) / susceptible
+
+    def run(self, max_days=10000):
+        """Integrate the model of every point. Returns the (points x days x metrics) expected series"""
+        k = self.neighbours
+        p = self.infection_probability
+        mortality = self.mortality_probability
+        chances = self.sick_day_chances()
+        population_count = float(self.data_handler.population_size ** 2)
+        initial = float(len(initial_cells(self.data_handler)))
+
+        # Day 0: the initial people get infected and may die
+        susceptible = np.full(self.point_count, population_count - initial)
+        infected = initial * chances * (1 - mortality)[:, np.newaxis]
+        contacts = self.initial_neighbours(population_count - initial)
+        neighbours_susceptible = np.full(self.point_count, k - contacts)
+        neighbours_infected = contacts * chances * (1 - mortality)[:, np.newaxis]
+        neighbours_other = contacts * mortality
+        rows = [np.stack([susceptible, initial * (1 - mortality), np.zeros(self.point_count),
+                          np.zeros(self.point_count), initial * mortality], axis=1)]
+        lengths = np.where(infected.sum(axis=1) < self.tolerance, 1, 0)
+
+        for current_day in range(1, max_days):
+            if lengths.all():
+                break
+            if self.closure == 'pair':
+                contagious = neighbours_infected.sum(axis=1) / k
+            else:
+                contagious = infected.sum(axis=1) / population_count
+            escape = 1 - p * contagious
+            new = susceptible * (1 - escape ** k)
+            susceptible = susceptible - new
+            recovered = infected[:, 1].copy()
+            infected = age(infected) + new[:, np.newaxis] * chances
+            dead = mortality * infected.sum(axis=1)
+            infected *= (1 - mortality)[:, np.newaxis]
+            infected_today = new * (1 - mortality)
+            rows.append(np.stack([susceptible, infected_today, infected.sum(axis=1) - infected_today,
+                                  recovered, dead], axis=1))
+
+            # Neighbours of the people that stayed susceptible, who were not infected by any of them
+            kept = np.where(escape > 0, escape, 1.0)
+            neighbours_susceptible = neighbours_susceptible / kept
+            neighbours_infected = neighbours_infected * ((1 - p) / kept)[:, np.newaxis]
+            neighbours_other = neighbours_other / kept
+            # A susceptible neighbour has k - 1 other neighbours like those of any susceptible person
+            neighbours_new = neighbours_susceptible * (1 - escape ** (k - 1))
+            neighbours_susceptible = neighbours_susceptible - neighbours_new
+            neighbours_other = neighbours_other + neighbours_infected[:, 1]
+            neighbours_infected = age(neighbours_infected) + neighbours_new[:, np.newaxis] * chances
+            neighbours_other = neighbours_other + mortality * neighbours_infected.sum(axis=1)
+            neighbours_infected *= (1 - mortality)[:, np.newaxis]
+
+            lengths = np.where((lengths == 0) & (infected.sum(axis=1) < self.tolerance), current_day + 1, lengths)
+        lengths[lengths == 0] = len(rows)
+
+        counts = np.stack(rows, axis=1)
+        series = np.zeros(counts.shape[:2] + (len(METRICS),))
+        series[..., SUSCEPTIBLE] = counts[..., 0]
+        series[..., INFECTED] = counts[..., 1]
+        series[..., SICK] = counts[..., 2]
+        series[..., RECOVERED] = counts[..., 3]
+        series[..., DEAD] = counts[..., 4]
+        series[..., ACC_INFECTED] = np.cumsum(counts[..., 1], axis=1)
+        series[..., ACC_RECOVERED] = np.cumsum(counts[..., 3], axis=1)
+        series[..., ACC_DEAD] = np.cumsum(counts[..., 4], axis=1)
+        self.series = series
+        self.lengths = lengths
+        return series
+
+    def frame(self, point=0):
+        """Return the expected series of a point as a DataFrame with the columns of DataHandler.data_summary"""
+        return pd.DataFrame(self.series[point, :self.lengths[point]], columns=METRICS)
+
+    def final(self, metric):
+        """Return the value of a metric on the last day of every point"""
+        return self.series[np.arange(self.point_count), self.lengths - 1, METRICS.index(metric)]
+
+
+def age(infected):
+    """Let the infected people of one day grow one day older. Those with 1 day left recover and are dropped"""
+    older = np.zeros_like(infected)
+    older[:, 0] = infected[:, 0]
+    older[:, 1:-1] = infected[:, 2:]
+    return older
+
+
+def screen(data_handler, infection_probabilities, mortality_probabilities, intervals, closure='pair'):
+    """Run the surrogate on every combination of the parameters. Returns one row per combination"""
+    points = list(itertools.product(infection_probabilities, mortality_probabilities, range(len(intervals))))
+    model = PairApproximation(data_handler, [point[0] for point in points], [point[1] for point in points],
+                              [intervals[point[2]] for point in points], closure)
+    model.run()
+    sick = model.series[..., SICK]
+    data = {
+        'infection probability': [point[0] for point in points],
+        'mortality probability': [point[1] for point in points],
+        'min days': [intervals[point[2]]['minDays'] for point in points],
+        'max days': [intervals[point[2]]['maxDays'] for point in points],
+        'infected': model.final('infected_accumulated'),
+        'dead': model.final('dead_accumulated'),
+        'days': model.lengths,
+        'peak day': sick.argmax(axis=1),
+        'peak sick': sick.max(axis=1),
+        'epidemic': model.final('infected_accumulated') > data_handler.epidemic_size()
+    }
+    return pd.DataFrame(data)
+
+
+def validate(data_handler, seeds, closure='pair'):
+    """Compare the surrogate with the mean of lattice runs for every infection probability of the data handler.
+
+    Returns one row per probability with the fraction of runs that were epidemics, the
+    mean final infected, dead and number of days of the runs, the values of the surrogate
+    and their relative errors, and the mean absolute error of the daily sick counts as a
+    fraction of the population.
+    """
+    from Simulation import Simulation
+    data_handler = copy.deepcopy(data_handler)
+    data_handler.output = 'none'
+    data_handler.visualize = 0
+    data_handler.classify_only = False
+    probabilities = data_handler.infection_probabilities
+    model = PairApproximation(data_handler, probabilities, closure=closure)
+    model.run()
+    simulation = Simulation(data_handler)
+    population_count = data_handler.population_size ** 2
+
+    rows = []
+    for point, prob in enumerate(probabilities):
+        data_handler.infection_probability = prob
+        runs = []
+        for seed in seeds:
+            data_handler.seed = seed
+            runs.append(simulation.run_simluation()['df'].values)
+        days = max(max(len(values) for values in runs), model.lengths[point])
+        sick = np.zeros((len(runs), days))
+        for number, values in enumerate(runs):
+            sick[number, :len(values)] = values[:, SICK]
+        expected_sick = np.zeros(days)
+        expected_sick[:model.lengths[point]] = model.frame(point)['sick_per_day'].values
+
+        lattice = {
+            'infected': np.mean([values[-1, ACC_INFECTED] for values in runs]),
+            'dead': np.mean([values[-1, ACC_DEAD] for values in runs]),
+            'days': np.mean([len(values) for values in runs])
+        }
+        surrogate = {
+            'infected': model.final('infected_accumulated')[point],
+            'dead': model.final('dead_accumulated')[point],
+            'days': model.lengths[point]
+        }
+        row = {'prob': prob, 'runs': len(runs),
+               'lattice epidemics': np.mean([values[-1, ACC_INFECTED] > data_handler.epidemic_size()
+                                             for values in runs])}
+        for name in lattice:
+            row['lattice ' + name] = lattice[name]
+            row['surrogate ' + name] = surrogate[name]
+            row[name + ' error'] = (surrogate[name] - lattice[name]) / lattice[name] if lattice[name] > 0 else np.nan
+        row['sick error'] = np.abs(sick.mean(axis=0) - expected_sick).mean() / population_count
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Screen parameters with the pair approximation of the lattice model.")
+    parser.add_argument('--size', type=int, default=100, help="population size")
+    parser.add_argument('--probabilities', nargs='+', type=float, default=list(np.linspace(0.02, 0.2, 19)))
+    parser.add_argument('--mortalities', nargs='+', type=float, default=[0.0])
+    parser.add_argument('--intervals', nargs='+', default=['4-8'], help="sick day intervals as min-max")
+    parser.add_argument('--closure', choices=CLOSURES, default='pair')
+    parser.add_argument('--validate', type=int, default=0,
+                        help="number of lattice runs per probability to compare with, 0 only screens")
+    parser.add_argument('--output', default=None, help="CSV file of the results")
+    arguments = parser.parse_args()
+
+    handler = DataHandler()
+    handler.population_size = arguments.size
+    # The frontier engine gives the results of the lattice model in a fraction of the time of the object engine
+    handler.engine = 'frontier'
+    handler.init_people_coordinates = [(arguments.size // 2, arguments.size // 2)]
+    handler.infection_probabilities = arguments.probabilities
+    handler.mortality_probability = arguments.mortalities[0]
+    interval_list = [{'minDays': int(text.split('-')[0]), 'maxDays': int(text.split('-')[1])}
+                     for text in arguments.intervals]
+    handler.interval = interval_list[0]
+
+    start = time.perf_counter()
+    if arguments.validate > 0:
+        results = validate(handler, list(range(1, arguments.validate + 1)), arguments.closure)
+    else:
+        results = screen(handler, arguments.probabilities, arguments.mortalities, interval_list, arguments.closure)
+    print(results.to_string())
+    print("Seconds:", round(time.perf_counter() - start, 3))
+    if arguments.output:
+        results.to_csv(arguments.output)
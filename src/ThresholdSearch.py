@@ -0,0 +1,175 @@
+import numpy as np
+
+
+class ThresholdSearch:
+    """Find the infection probability at which half of the runs turn into an epidemic.
+
+    A run is an epidemic when more than half the population gets infected. The search
+    bisects the infection probability between the smallest and largest entry of
+    DataHandler.infection_probabilities. At every probability it runs seeds one at a
+    time and stops as soon as a sequential probability ratio test tells whether most
+    runs are epidemics or not, so points far from the threshold only cost a few runs.
+
+    The tests only steer the bisection. The threshold and its interval come from a
+    logistic dose-response fitted to the epidemics and runs of every probed point.
+    """
+
+    def __init__(self, simulation, tolerance=0.001, alpha=0.05, beta=0.05, indifference=0.2):
+        self.simulation = simulation
+        self.data_handler = simulation.data_handler
+        self.tolerance = tolerance
+        self.alpha = alpha
+        self.beta = beta
+        # The test decides between an epidemic chance of 0.5 - indifference and 0.5 + indifference
+        self.indifference = indifference
+        self.points = []
+
+    def classify(self, prob):
+        """Run seeds with an infection probability until the test decides. Returns True for an epidemic"""
+        data_handler = self.data_handler
+        data_handler.infection_probability = prob
+        below = 0.5 - self.indifference
+        above = 0.5 + self.indifference
+        epidemic_step = np.log(above / below)
+        no_epidemic_step = np.log((1.0 - above) / (1.0 - below))
+        upper = np.log((1.0 - self.beta) / self.alpha)
+        lower = np.log(self.beta / (1.0 - self.alpha))
+
+        ratio = 0.0
+        epidemics = 0
+        runs = 0
+        decided = False
+        for seed in data_handler.random_seeds:
+            data_handler.seed = seed
+            result = self.simulation.run_simluation()
+            runs += 1
+            if result['epidemic']:
+                epidemics += 1
+                ratio += epidemic_step
+            else:
+                ratio += no_epidemic_step
+            if ratio >= upper or ratio <= lower:
+                decided = True
+                break
+
+        # Without a decision the seeds ran out inside the indifference zone, so use the majority
+        epidemic = bool(ratio >= upper if decided else 2 * epidemics >= runs)
+        self.points.append({'prob': prob, 'runs': runs, 'epidemics': epidemics,
+                            'epidemic': epidemic, 'decided': decided})
+        return epidemic
+
+    def run(self):
+        """Search for the threshold. Returns the estimate, its interval and the number of runs used"""
+        # Only the outcome of the runs matters, so stop them as soon as it is known
+        classify_only = self.data_handler.classify_only
+        self.data_handler.classify_only = True
+        try:
+            return self.search()
+        finally:
+            self.data_handler.classify_only = classify_only
+
+    def search(self):
+        """Bisect the infection probability until the bracket is narrower than the tolerance"""
+        low = min(self.data_handler.infection_probabilities)
+        high = max(self.data_handler.infection_probabilities)
+        if self.classify(low):
+            print("Runs are epidemics already at infection probability", low)
+            return self.summary(None, None)
+        if not self.classify(high):
+            print("Runs are no epidemics even at infection probability", high)
+            return self.summary(None, None)
+
+        while high - low > self.tolerance:
+            middle = round((low + high) / 2, 10)
+            if self.classify(middle):
+                high = middle
+            else:
+                low = middle
+        return self.summary(low, high)
+
+    def summary(self, low, high):
+        """Summarize the search.
+
+        The threshold is the 50% crossing of the fitted dose-response and the interval its
+        profile likelihood interval at the confidence level of the data handler. A bound is
+        None if the interval reaches past the probed probabilities. The bracket is where the
+        bisection stopped.
+        """
+        confidence = self.data_handler.confidence_level
+        threshold, interval = None, None
+        if low is not None:
+            threshold, interval = fit_threshold(self.points, confidence)
+        data = {
+            'threshold': threshold,
+            'interval': interval,
+            'confidence': confidence,
+            'bracket': None if low is None else (low, high),
+            'runs': sum(point['runs'] for point in self.points),
+            'points': self.points
+        }
+        return data
+
+
+def logistic_log_likelihood(x, epidemics, runs, threshold, slope):
+    """Binomial log likelihood of the epidemics when the chance of one is 1 / (1 + exp(-slope * (x - threshold)))"""
+    z = slope * (x - threshold)
+    return -float(np.sum(epidemics * np.logaddexp(0, -z) + (runs - epidemics) * np.logaddexp(0, z)))
+
+
+def fit_threshold(points, confidence=0.95, grid_size=401, max_slope=1e4):
+    """Fit a logistic dose-response to the probed points and return its 50% crossing and profile likelihood interval.
+
+    The probabilities are scaled to [0, 1] over the probed range, and for every threshold
+    on a grid over that range the slope is fitted with the threshold fixed. The interval
+    holds the thresholds whose deviance from the best fit is within the chi-square
+    quantile of the confidence level. As the likelihood does not depend on when the
+    sequential tests stopped, the points are used as plain binomial counts.
+    Returns (threshold, (lower, upper)).
+    """
+    from scipy import optimize
+    from scipy import stats
+    probs = np.array([point['prob'] for point in points], dtype=float)
+    epidemics = np.array([point['epidemics'] for point in points], dtype=float)
+    runs = np.array([point['runs'] for point in points], dtype=float)
+    start = probs.min()
+    scale = probs.max() - start
+    x = (probs - start) / scale
+
+    def profile(threshold):
+        # The log likelihood is concave in the slope, so the bounded search finds its maximum
+        fit = optimize.minimize_scalar(
+            lambda log_slope: -logistic_log_likelihood(x, epidemics, runs, threshold, np.exp(log_slope)),
+            bounds=(np.log(1e-3), np.log(max_slope)), method='bounded')
+        return -fit.fun
+
+    grid = np.linspace(0.0, 1.0, grid_size)
+    likelihoods = np.array([profile(threshold) for threshold in grid])
+    best = int(np.argmax(likelihoods))
+    first, last = best, best
+    while first > 0 and likelihoods[first - 1] >= likelihoods[best] - 1e-6:
+        first -= 1
+    while last < grid_size - 1 and likelihoods[last + 1] >= likelihoods[best] - 1e-6:
+        last += 1
+    if first < last:
+        # Separated outcomes leave a flat top, whose middle is the estimate
+        threshold, maximum = (grid[first] + grid[last]) / 2, likelihoods[best]
+    else:
+        fit = optimize.minimize_scalar(lambda threshold: -profile(threshold), method='bounded',
+                                       bounds=(grid[max(best - 1, 0)], grid[min(best + 1, grid_size - 1)]))
+        threshold, maximum = fit.x, -fit.fun
+    cutoff = maximum - stats.chi2.ppf(confidence, 1) / 2
+
+    def bound(indices):
+        """Return where the profile first drops below the cutoff along the grid indices, or None"""
+        previous = threshold
+        for index in indices:
+            if likelihoods[index] < cutoff:
+                return optimize.brentq(lambda value: profile(value) - cutoff, previous, grid[index])
+            previous = grid[index]
+        return None
+
+    lower = bound(range(best, -1, -1))
+    upper = bound(range(best, grid_size))
+    return (float(start + scale * threshold),
+            (None if lower is None else float(start + scale * lower),
+             None if upper is None else float(start + scale * upper)))
@@ -0,0 +1,189 @@
+import numpy as np
+import os
+
+
+class Topology:
+    """Contact network stored as compressed sparse rows.
+
+    The neighbours of node i are indices[indptr[i]:indptr[i + 1]], sorted. The people of
+    a population_size x population_size population are the nodes x * population_size + y,
+    the flat index of their cell.
+    """
+
+    def __init__(self, indptr, indices):
+        self.indptr = indptr
+        self.indices = indices
+        self.adjacency = None
+
+    @property
+    def node_count(self):
+        return len(self.indptr) - 1
+
+    @property
+    def nbytes(self):
+        """Memory used by the index arrays in bytes"""
+        return self.indptr.nbytes + self.indices.nbytes
+
+    @classmethod
+    def from_pairs(cls, sources, targets, node_count):
+        """Build an undirected network from pairs of connected nodes, dropping self loops and duplicates"""
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        if len(sources) > 0 and max(sources.max(), targets.max()) >= node_count:
+            raise ValueError("The network has nodes beyond the %d people of the population" % node_count)
+        from scipy import sparse
+        keep = sources != targets
+        sources, targets = sources[keep], targets[keep]
+        # Every pair becomes an edge in both directions. Converting to CSR sorts the
+        # neighbours of every node and sum_duplicates merges repeated edges.
+        matrix = sparse.csr_matrix((np.ones(2 * len(sources), dtype=np.int32),
+                                    (np.concatenate((sources, targets)), np.concatenate((targets, sources)))),
+                                   shape=(node_count, node_count))
+        matrix.sum_duplicates()
+        return cls(matrix.indptr, matrix.indices)
+
+    def degrees(self):
+        """Return the number of neighbours of every node"""
+        return np.diff(self.indptr)
+
+    def max_degree(self):
+        """Return the largest number of neighbours of a node"""
+        return int(self.degrees().max()) if self.node_count > 0 else 0
+
+    def neighbours(self, node):
+        """Return the neighbours of a node"""
+        return self.indices[self.indptr[node]:self.indptr[node + 1]]
+
+    def pairs(self):
+        """Return the (source, target) pairs of all edges, both directions included"""
+        return np.repeat(np.arange(self.node_count), self.degrees()), self.indices
+
+    def matrix(self):
+        """Return the adjacency matrix as a scipy CSR matrix sharing the index arrays"""
+        if self.adjacency is None:
+            from scipy import sparse
+            self.adjacency = sparse.csr_matrix(
+                (np.ones(len(self.indices), dtype=np.int32), self.indices, self.indptr),
+                shape=(self.node_count, self.node_count))
+        return self.adjacency
+
+
+def lattice(population_size, radius=1):
+    """Torus where every cell is connected to the cells within radius steps in x and y.
+
+    Radius 1 gives the 8 closest neighbours of Population.generate_neighbours.
+    """
+    cells = np.arange(population_size * population_size, dtype=np.int64)
+    x, y = np.divmod(cells, population_size)
+    sources = []
+    targets = []
+    for dx in range(-radius, radius + 1):
+        for dy in range(-radius, radius + 1):
+            if (dx, dy) > (0, 0):
+                sources.append(cells)
+                targets.append((x + dx) % population_size * population_size + (y + dy) % population_size)
+    return Topology.from_pairs(np.concatenate(sources), np.concatenate(targets), len(cells))
+
+
+def small_world(population_size, radius=1, rewire_probability=0.1, seed=None):
+    """Lattice where every edge is moved to a random person with the given probability (Watts-Strogatz)"""
+    generator = np.random.Generator(np.random.PCG64(seed))
+    sources, targets = lattice(population_size, radius).pairs()
+    # Rewire every undirected edge once, from its lower numbered end
+    once = sources < targets
+    sources, targets = sources[once], targets[once].astype(np.int64)
+    rewired = generator.random(len(targets)) < rewire_probability
+    node_count = population_size * population_size
+    targets[rewired] = generator.integers(0, node_count, np.count_nonzero(rewired))
+    return Topology.from_pairs(sources, targets, node_count)
+
+
+def scale_free(node_count, edges_per_node=4, seed=None):
+    """Network grown by preferential attachment (Barabasi-Albert).
+
+    Every new person connects to edges_per_node earlier people picked with chance
+    proportional to their number of neighbours. Picking the same person twice
+    gives one edge, so a few people get fewer edges.
+    """
+    generator = np.random.Generator(np.random.PCG64(seed))
+    start = min(edges_per_node + 1, node_count)
+    # Every edge end is listed once, so a uniform pick from the list is proportional to degree
+    ends = np.empty(2 * (start * start + node_count * edges_per_node), dtype=np.int64)
+    first, second = np.triu_indices(start, 1)
+    filled = 2 * len(first)
+    ends[:filled:2] = first
+    ends[1:filled:2] = second
+    for node in range(start, node_count):
+        picked = ends[generator.integers(0, filled, edges_per_node)]
+        ends[filled:filled + 2 * edges_per_node:2] = node
+        ends[filled + 1:filled + 2 * edges_per_node:2] = picked
+        filled += 2 * edges_per_node
+    return Topology.from_pairs(ends[:filled:2], ends[1:filled:2], node_count)
+
+
+def load_edge_list(path, node_count):
+    """Read a network from a text file with one pair of whitespace separated node numbers per line"""
+    edges = np.loadtxt(path, dtype=np.int64, comments='#', ndmin=2)
+    if edges.shape[0] > 0 and edges.shape[1] < 2:
+        raise ValueError("Every line of an edge list needs two nodes: %s" % path)
+    return Topology.from_pairs(edges[:, 0], edges[:, 1], node_count)
+
+
+def create_topology(data_handler):
+    """Create the contact network selected in the data handler"""
+    size = data_handler.population_size
+    if data_handler.topology == 'lattice':
+        return lattice(size, data_handler.topology_radius)
+    if data_handler.topology == 'small_world':
+        return small_world(size, data_handler.topology_radius, data_handler.rewire_probability,
+                           data_handler.topology_seed)
+    if data_handler.topology == 'scale_free':
+        return scale_free(size * size, data_handler.edges_per_node, data_handler.topology_seed)
+    if data_handler.topology == 'edge_list':
+        return load_edge_list(data_handler.edge_list_path, size * size)
+    raise ValueError("Unknown topology: %s" % data_handler.topology)
+
+
+# Networks built by shared_topology, by topology_key
+topologies = {}
+# Number of networks kept by shared_topology
+TOPOLOGY_CACHE_SIZE = 4
+
+
+def topology_key(data_handler):
+    """Return the parameters that determine the contact network of the data handler"""
+    key = (data_handler.population_size, data_handler.topology)
+    if data_handler.topology == 'lattice':
+        return key + (data_handler.topology_radius,)
+    if data_handler.topology == 'small_world':
+        return key + (data_handler.topology_radius, data_handler.rewire_probability, data_handler.topology_seed)
+    if data_handler.topology == 'scale_free':
+        return key + (data_handler.edges_per_node, data_handler.topology_seed)
+    if data_handler.topology == 'edge_list':
+        # A changed file gives a new network
+        return key + (data_handler.edge_list_path, os.path.getmtime(data_handler.edge_list_path))
+    raise ValueError("Unknown topology: %s" % data_handler.topology)
+
+
+def shared_topology(data_handler):
+    """Return the contact network of the data handler, built once and shared by every run.
+
+    The index arrays are read-only, so runs cannot change the network of the next run.
+    Worker processes forked after the network was built share its memory.
+    """
+    key = topology_key(data_handler)
+    topology = topologies.pop(key, None)
+    if topology is None:
+        topology = create_topology(data_handler)
+        topology.indptr.setflags(write=False)
+        topology.indices.setflags(write=False)
+        if len(topologies) >= TOPOLOGY_CACHE_SIZE:
+            del topologies[next(iter(topologies))]
+    # The most recently used network goes last
+    topologies[key] = topology
+    return topology
+
+
+def is_moore_lattice(data_handler):
+    """Return True if the data handler selects the torus with the 8 closest neighbours"""
+    return data_handler.topology == 'lattice' and data_handler.topology_radius == 1